@@ -1,5 +1,16 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
 
 
 class AccountxConfig(AppConfig):
     name = 'accountx'
+
+    def ready(self):
+        from . import directory, duplicates  # noqa: F401 (connects the signal receivers)
+        if getattr(settings, 'ACCOUNTX_SQLITE_PRAGMAS', None):
+            from .db import configure_sqlite
+            connection_created.connect(configure_sqlite)
+        from .permissions import clear_permission_ids
+        post_migrate.connect(clear_permission_ids)
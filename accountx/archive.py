@@ -0,0 +1,88 @@
+"""
+Archiving of closed fiscal years.
+The sales and purchases of a fiscal year (by cashflow date) are moved into the archive
+tables once the whole year is covered by closed periods. Their object permissions are
+removed, access to archived bookings is derived from the view_company permission.
+The clients see the archived bookings as deleted (Tombstone and ChangeLog entries).
+The archive lives in the database ACCOUNTX_ARCHIVE_DATABASE (default: the default database).
+"""
+import datetime
+import json
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from . import events, models
+
+BATCH_SIZE = 500
+
+ARCHIVES = {
+    models.Sale: models.ArchivedSale,
+    models.Purchase: models.ArchivedPurchase,
+}
+
+
+def database():
+    return getattr(settings, 'ACCOUNTX_ARCHIVE_DATABASE', 'default')
+
+
+def archived(model):
+    """
+    Returns a queryset of the archived objects of the model (Sale or Purchase).
+    """
+    return ARCHIVES[model].objects.using(database())
+
+
+def year_closed(company, year):
+    """
+    Returns whether the whole year is covered by closed periods of the company.
+    """
+    start = datetime.date(year, 1, 1)
+    end = datetime.date(year, 12, 31)
+    covered = start
+    periods = models.ClosedPeriod.objects.filter(
+        company=company, start__lte=end, end__gte=start).order_by('start')
+    for period in periods:
+        if period.start > covered:
+            return False
+        covered = max(covered, period.end + datetime.timedelta(days=1))
+        if covered > end:
+            return True
+    return False
+
+
+def _archive_model(model, company, year):
+    archive = ARCHIVES[model]
+    fields = [field.name for field in archive._meta.concrete_fields
+              if field.name not in ('company', 'invoice', 'archived_at')]
+    content_type = ContentType.objects.get_for_model(model)
+    ids = list(model.objects.filter(company=company, cashflowdate__year=year)
+               .order_by('pk').values_list('pk', flat=True))
+    for offset in range(0, len(ids), BATCH_SIZE):
+        batch = ids[offset:offset + BATCH_SIZE]
+        rows = list(model.objects.filter(pk__in=batch).prefetch_related('invoice'))
+        archive.objects.using(database()).bulk_create([
+            archive(company_id=company.pk,
+                    invoice=json.dumps([media.pk for media in row.invoice.all()]),
+                    **{name: getattr(row, name) for name in fields})
+            for row in rows])
+        for permissions in (GroupObjectPermission, UserObjectPermission):
+            permissions.objects.filter(
+                content_type=content_type, object_pk__in=[str(pk) for pk in batch]).delete()
+        # for the clients the archived bookings are deleted (delta sync and event streams)
+        models.Tombstone.objects.bulk_create([
+            models.Tombstone(company_id=company.pk, model=model._meta.model_name, object_id=pk) for pk in batch])
+        events.record_changes(rows, 'delete')
+        model.objects.filter(pk__in=batch).delete()
+    return len(ids)
+
+
+def archive_year(company, year):
+    """
+    Moves the sales and purchases of the year into the archive.
+    Returns the number of archived sales and purchases.
+    """
+    with transaction.atomic(), transaction.atomic(using=database()):
+        return tuple(_archive_model(model, company, year) for model in ARCHIVES)
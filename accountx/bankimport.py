@@ -0,0 +1,232 @@
+"""
+Import of bank statements (CSV).
+The statement is parsed line by line, so the size of the file does not matter. Every transaction
+is matched against the open (no cashflow date) sales (incoming amounts) and purchases (outgoing
+amounts) of the company by amount, date and reference. The open bookings are indexed by their
+gross amount in cents once per import. The cashflow dates of the matched bookings are then
+updated in bulk.
+"""
+import csv
+import datetime
+import io
+import re
+
+from django.db import transaction
+from django.utils import timezone
+from guardian.shortcuts import get_objects_for_user
+
+from . import closing, events, models
+from .duplicates import normalize
+
+BATCH_SIZE = 500
+
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%m/%d/%Y']
+
+
+class Candidate:
+    """
+    An open booking which can be paid by a transaction.
+    The invoice key (invoice number) and the name key (customer or biller) are normalized,
+    empty keys never match.
+    """
+
+    def __init__(self, model, pk, invDate, invoiceKey, nameKey):
+        self.model = model
+        self.pk = pk
+        self.invDate = invDate
+        self.invoiceKey = invoiceKey
+        self.nameKey = nameKey
+        self.matched = False
+
+
+class Reference:
+    """
+    The normalized reference of a transaction (like duplicates.normalize) with the offsets at which
+    its words start and end, so keys only match whole words (or runs of words, e.g. "INV 0123").
+    """
+
+    def __init__(self, reference):
+        self.key = ''
+        self.bounds = {0}
+        for word in re.findall(r'[^\W_]+', (reference or '').casefold()):
+            if not self.key[-1:].isdigit():
+                word = re.sub(r'^0+(?=\d)', '', word)
+            self.key += re.sub(r'(?<=\D)0+(?=\d)', '', word)
+            self.bounds.add(len(self.key))
+
+    def contains(self, key):
+        if not key:
+            return False
+        start = self.key.find(key)
+        while start != -1:
+            if start in self.bounds and start + len(key) in self.bounds:
+                return True
+            start = self.key.find(key, start + 1)
+        return False
+
+
+def _cents(amount):
+    return int(round(amount * 100))
+
+
+def _bookings(model, company, user, action):
+    bookings = model.objects.filter(company=company, cashflowdate__isnull=True)
+    if user is None:
+        return bookings
+    return get_objects_for_user(user, '%s_%s' % (action, model._meta.model_name), klass=bookings)
+
+
+def build_index(company, user=None):
+    """
+    Returns the open bookings of the company (which the user can view) by gross amount in cents.
+    Sales have positive amounts, purchases negative ones.
+    """
+    index = {}
+    sales = _bookings(models.Sale, company, user, 'view').values_list(
+        'pk', 'net', 'vat', 'invDate', 'customerKey')
+    for pk, net, vat, invDate, customerKey in sales.iterator():
+        index.setdefault(_cents(net * (1 + vat)), []).append(Candidate(
+            models.Sale, pk, invDate, normalize(str(invDate.year) + str(pk)), customerKey))
+    purchases = _bookings(models.Purchase, company, user, 'view').values_list(
+        'pk', 'net', 'vat', 'invDate', 'invNoKey', 'billerKey')
+    for pk, net, vat, invDate, invNoKey, billerKey in purchases.iterator():
+        index.setdefault(-_cents(net * (1 + vat)), []).append(Candidate(
+            models.Purchase, pk, invDate, invNoKey, billerKey))
+    return index
+
+
+def parse_amount(value, decimal):
+    value = value.strip().replace(' ', '')
+    if decimal == ',':
+        value = value.replace('.', '').replace(',', '.')
+    else:
+        value = value.replace(',', '')
+    return float(value)
+
+
+def parse_date(value, dateFormat=None):
+    for candidate in [dateFormat] if dateFormat else DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), candidate).date()
+        except ValueError:
+            continue
+    raise ValueError('Unknown date format: %s' % value)
+
+
+def _chain(lines, stream):
+    yield from lines
+    yield from stream
+
+
+def read_transactions(upload, options):
+    """
+    Yields (line, date, amount, reference) for every line of the uploaded CSV file.
+    Lines which cannot be parsed are yielded with an error instead.
+    """
+    stream = io.TextIOWrapper(upload, encoding=options.get('encoding', 'utf-8-sig'), newline='')
+    delimiter = options.get('delimiter')
+    if not delimiter:
+        sample = stream.readline()
+        delimiter = ';' if sample.count(';') > sample.count(',') else ','
+        lines = [sample]
+    else:
+        lines = []
+    dateColumn = options.get('dateColumn', 'date')
+    amountColumn = options.get('amountColumn', 'amount')
+    referenceColumn = options.get('referenceColumn', 'reference')
+    reader = csv.DictReader(_chain(lines, stream), delimiter=delimiter)
+    for line, row in enumerate(reader, start=2):
+        try:
+            yield line, parse_date(row[dateColumn], options.get('dateFormat')), parse_amount(
+                row[amountColumn], options.get('decimal', '.')), row.get(referenceColumn) or '', None
+        except (KeyError, ValueError, TypeError) as exc:
+            yield line, None, None, None, str(exc)
+
+
+def match(index, date, amount, reference, window):
+    """
+    Returns the best open booking for the transaction and the confidence (0 - 1).
+    The amount has to match (1 cent tolerance) and the transaction has to be within
+    window days of the invoice date. A matching invoice number or name in the
+    reference and a short time since the invoice increase the confidence.
+    """
+    cents = _cents(amount)
+    reference = Reference(reference)
+    scored = []
+    for amountKey in (cents, cents - 1, cents + 1):
+        for candidate in index.get(amountKey, ()):
+            delay = (date - candidate.invDate).days
+            if candidate.matched or delay < -window or delay > window:
+                continue
+            confidence = 0.5 + 0.1 * (1 - abs(delay) / (window or 1))
+            if reference.contains(candidate.invoiceKey):
+                confidence += 0.3
+            if reference.contains(candidate.nameKey):
+                confidence += 0.1
+            scored.append((confidence, candidate))
+    if not scored:
+        return None, 0.0
+    scored.sort(key=lambda item: item[0], reverse=True)
+    confidence, best = scored[0]
+    ties = sum(1 for item in scored if item[0] == confidence)
+    return best, round(confidence / ties, 3)
+
+
+def import_statement(company, upload, options, apply=True, user=None):
+    """
+    Matches the transactions of the statement and sets the cashflow dates of the matched bookings
+    (if apply is set and the confidence is at least options['minConfidence']).
+    With a user only the bookings the user can view are matched and only those the user can change
+    are updated. The options are validated by the BankImportSerializer.
+    Returns the report.
+    """
+    window = options.get('window', 60)
+    minConfidence = options.get('minConfidence', 0.5)
+    index = build_index(company, user)
+    closedRanges = closing.closed_ranges(company)
+    changeable = None
+    if apply and user is not None:
+        changeable = {model: set(_bookings(model, company, user, 'change').values_list('pk', flat=True))
+                      for model in (models.Sale, models.Purchase)}
+    report = {'transactions': 0, 'matched': [], 'unmatched': [], 'errors': []}
+    updates = {models.Sale: {}, models.Purchase: {}}
+    for line, date, amount, reference, error in read_transactions(upload, options):
+        if error is not None:
+            report['errors'].append({'line': line, 'error': error})
+            continue
+        report['transactions'] += 1
+        candidate, confidence = match(index, date, amount, reference, window)
+        entry = {'line': line, 'date': date, 'amount': amount, 'reference': reference}
+        if candidate is None or confidence < minConfidence:
+            report['unmatched'].append(entry)
+            continue
+        candidate.matched = True
+        entry.update({'model': candidate.model._meta.model_name, 'id': candidate.pk,
+                      'confidence': confidence, 'applied': False})
+        if apply and (changeable is None or candidate.pk in changeable[candidate.model]) and not any(
+                start <= date <= end for start, end in closedRanges):
+            updates[candidate.model][candidate.pk] = date
+            entry['applied'] = True
+        report['matched'].append(entry)
+    if apply:
+        _apply(updates)
+    return report
+
+
+def _apply(updates):
+    """
+    Sets the cashflow dates in bulk.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        for model, dates in updates.items():
+            ids = list(dates)
+            for offset in range(0, len(ids), BATCH_SIZE):
+                bookings = list(model.objects.filter(
+                    pk__in=ids[offset:offset + BATCH_SIZE]))
+                for booking in bookings:
+                    booking.cashflowdate = dates[booking.pk]
+                    booking.updated_at = now
+                model.objects.bulk_update(
+                    bookings, ['cashflowdate', 'updated_at'])
+                events.record_changes(bookings, 'update')
@@ -0,0 +1,102 @@
+"""
+Execution of batch requests.
+Every operation of a batch is dispatched to the view of its path (only the routes of this app).
+Later operations can reference results of earlier ones: a string "$<index>.<path>" (e.g. "$0.id")
+is replaced by the value in the response body of the operation with this index, within the
+request path the reference is replaced in place (e.g. "/sales/$1.id/").
+"""
+import json
+import re
+from io import BytesIO
+
+from django.http import HttpRequest, QueryDict
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import ValidationError
+
+MAX_OPERATIONS = 50
+
+REFERENCE = re.compile(r'\$(\d+)\.([\w.]+)')
+
+
+def _lookup(results, index, path):
+    index = int(index)
+    if index >= len(results):
+        raise ValidationError('Operation %d is referenced before it is executed' % index)
+    value = results[index]['body']
+    for key in path.split('.'):
+        try:
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise ValidationError('Reference $%d.%s not found' % (index, path))
+    return value
+
+
+def resolve_references(value, results):
+    """
+    Replaces the references in the (JSON) value by the values of the earlier results.
+    """
+    if isinstance(value, dict):
+        return {key: resolve_references(item, results) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_references(item, results) for item in value]
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match:
+            return _lookup(results, *match.groups())
+    return value
+
+
+def resolve_path(path, results):
+    return REFERENCE.sub(lambda match: str(_lookup(results, *match.groups())), path)
+
+
+def dispatch(request, operation, results, files):
+    """
+    Executes a single operation as a sub-request of the batch request.
+    The user of the batch request is used, so the sub-requests are not authenticated again.
+    Returns the status and the body of the response.
+    """
+    path = resolve_path(operation['path'], results)
+    path, _, query = path.partition('?')
+    try:
+        match = resolve(path, urlconf='accountx.urls')
+    except Resolver404:
+        raise ValidationError('Unknown path %s' % path)
+    if match.url_name == 'batch':
+        raise ValidationError('Batch requests cannot be nested')
+    body = resolve_references(operation.get('body'), results)
+    if operation.get('files'):
+        data = dict(body or {})
+        for field, name in operation['files'].items():
+            if name not in files:
+                raise ValidationError('File %s is missing' % name)
+            data[field] = files[name]
+        content, contentType = encode_multipart(BOUNDARY, data), MULTIPART_CONTENT
+    elif body is not None:
+        content, contentType = json.dumps(body).encode(), 'application/json'
+    else:
+        content, contentType = b'', 'application/json'
+
+    sub = HttpRequest()
+    sub.method = operation['method']
+    sub.path = sub.path_info = path
+    sub.META = {key: value for key, value in request.META.items()
+                if not key.startswith('CONTENT_') and key not in ('HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING')}
+    sub.META.update({'REQUEST_METHOD': sub.method, 'PATH_INFO': path, 'QUERY_STRING': query,
+                     'CONTENT_TYPE': contentType, 'CONTENT_LENGTH': str(len(content)),
+                     'HTTP_ACCEPT': 'application/json'})
+    sub.GET = QueryDict(query)
+    sub.COOKIES = request.COOKIES
+    sub._stream = BytesIO(content)
+    sub._read_started = False
+    sub.user = request.user
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+
+    response = match.func(sub, *match.args, **match.kwargs)
+    if response.streaming:
+        raise ValidationError('Streaming responses are not supported in batches (%s)' % path)
+    if hasattr(response, 'data'):
+        return response.status_code, response.data
+    return response.status_code, None
@@ -0,0 +1,159 @@
+"""
+Calculation of the cashflow timeline of a company.
+Sales count as inflow and purchases as outflow (both gross) on their cashflow date.
+The running balance includes all bookings before the requested range, so the first
+bucket already starts with the correct opening balance.
+"""
+import datetime
+
+from django.db import connections
+from django.db.models import ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import TruncWeek
+
+from . import archive, models
+
+INTERVALS = {
+    'day': F,
+    'week': TruncWeek,
+}
+
+
+def bucket_start(date, interval):
+    """
+    Returns the first day of the bucket the given date belongs to.
+    Weeks start on monday (like TruncWeek does).
+    """
+    if interval == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    return date
+
+
+def _as_date(value):
+    """
+    Some backends (e.g. SQLite) return the truncated dates as strings.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def _flows(sales, purchases, interval):
+    """
+    Returns a queryset with one row (bucket, amount) per booking of the given querysets.
+    Sales are positive, purchases negative.
+    """
+    trunc = INTERVALS[interval]
+    gross = ExpressionWrapper(
+        F('net') * (Value(1.0) + F('vat')), output_field=FloatField())
+    sales = sales.filter(cashflowdate__isnull=False).annotate(
+        bucket=trunc('cashflowdate'), amount=gross).values_list('bucket', 'amount')
+    purchases = purchases.filter(cashflowdate__isnull=False).annotate(
+        bucket=trunc('cashflowdate'),
+        amount=ExpressionWrapper(gross * Value(-1.0), output_field=FloatField())).values_list('bucket', 'amount')
+    return sales.union(purchases, all=True)
+
+
+def _timeline(flows, start):
+    if connections[flows.db].features.supports_over_clause:
+        return _timeline_window(flows, start)
+    return _timeline_stream(flows, start)
+
+
+def _merge(live, archived, include_archived=True):
+    """
+    Merges two timelines (both sorted by bucket), the balances are added up.
+    Without include_archived only the buckets and flows of the live timeline are returned,
+    their balance still includes the archived flows.
+    """
+    live = iter(live)
+    archived = iter(archived)
+    a = next(live, None)
+    b = next(archived, None)
+    liveBalance = archivedBalance = 0.0
+    while a is not None or b is not None:
+        bucket = min(row[0] for row in (a, b) if row is not None)
+        inflow = outflow = 0.0
+        listed = include_archived
+        if a is not None and a[0] == bucket:
+            inflow, outflow, liveBalance = inflow + a[1], outflow + a[2], a[3]
+            a = next(live, None)
+            listed = True
+        if b is not None and b[0] == bucket:
+            if include_archived:
+                inflow, outflow = inflow + b[1], outflow + b[2]
+            archivedBalance = b[3]
+            b = next(archived, None)
+        if listed:
+            yield bucket, inflow, outflow, liveBalance + archivedBalance
+
+
+def _timeline_window(flows, start):
+    """
+    Calculates the buckets and the running balance in a single query using a window function.
+    """
+    connection = connections[flows.db]
+    inner_sql, inner_params = flows.query.get_compiler(using=flows.db).as_sql()
+    sql = (
+        'SELECT bucket, inflow, outflow, balance FROM ('
+        'SELECT bucket, '
+        'SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS inflow, '
+        'SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END) AS outflow, '
+        'SUM(SUM(amount)) OVER (ORDER BY bucket ROWS UNBOUNDED PRECEDING) AS balance '
+        'FROM (%s) flows GROUP BY bucket'
+        ') timeline WHERE bucket >= %%s ORDER BY bucket' % inner_sql
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, inner_params + (start,))
+        for bucket, inflow, outflow, balance in cursor:
+            yield _as_date(bucket), inflow, outflow, balance
+
+
+def _timeline_stream(flows, start):
+    """
+    Fallback for backends without window functions.
+    The rows are streamed ordered by bucket and accumulated in a single pass.
+    """
+    balance = 0.0
+    current = None
+    inflow = outflow = 0.0
+    for bucket, amount in flows.order_by('bucket').iterator():
+        bucket = _as_date(bucket)
+        if bucket != current:
+            if current is not None and current >= start:
+                yield current, inflow, outflow, balance
+            current = bucket
+            inflow = outflow = 0.0
+        if amount > 0:
+            inflow += amount
+        else:
+            outflow -= amount
+        balance += amount
+    if current is not None and current >= start:
+        yield current, inflow, outflow, balance
+
+
+def cashflow_timeline(company, after, before, interval='day', include_archived=False):
+    """
+    Returns a list of dicts (date, inflow, outflow, net, balance) for every bucket
+    between after and before containing at least one cashflow.
+    With include_archived, the archived bookings are merged into the timeline. The balance always
+    includes them, so archiving a year does not change the balance of the following years.
+    """
+    start = bucket_start(after, interval)
+    flows = _flows(
+        models.Sale.objects.filter(company=company, cashflowdate__lte=before),
+        models.Purchase.objects.filter(company=company, cashflowdate__lte=before),
+        interval)
+    # the archived bookings are always part of the balance, even if they are not listed
+    archivedFlows = _flows(
+        archive.archived(models.Sale).filter(company=company, cashflowdate__lte=before),
+        archive.archived(models.Purchase).filter(company=company, cashflowdate__lte=before),
+        interval)
+    rows = (row for row in _merge(_timeline(flows, datetime.date.min), _timeline(archivedFlows, datetime.date.min),
+                                  include_archived)
+            if row[0] >= start)
+    return [{'date': bucket, 'inflow': inflow, 'outflow': outflow,
+             'net': inflow - outflow, 'balance': balance}
+            for bucket, inflow, outflow, balance in rows]
@@ -0,0 +1,102 @@
+"""
+Closing of periods.
+A closed period stores the totals of its sales and purchases (by cashflow date), which
+are then used by the reports instead of recalculating them from the bookings.
+"""
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Sum, Value
+from rest_framework.exceptions import PermissionDenied
+
+from . import archive, models
+
+VAT = ExpressionWrapper(F('vat') * F('net'), output_field=FloatField())
+GROSS = ExpressionWrapper(
+    F('net') * (Value(1.0) + F('vat')), output_field=FloatField())
+
+
+def is_closed(company, date):
+    """
+    Returns whether the date is within a closed period of the company.
+    """
+    if date is None:
+        return False
+    return models.ClosedPeriod.objects.filter(
+        company=company, start__lte=date, end__gte=date).exists()
+
+
+def closed_ranges(company):
+    """
+    Returns the (start, end) tuples of all closed periods of the company.
+    """
+    return list(models.ClosedPeriod.objects.filter(company=company).values_list('start', 'end'))
+
+
+def ensure_open(company, *dates):
+    """
+    Raises PermissionDenied if any of the dates is within a closed period of the company.
+    """
+    if any(is_closed(company, date) for date in dates):
+        raise PermissionDenied(detail="The period is closed")
+
+
+def _totals(queryset):
+    return queryset.values('bookingType').annotate(
+        vatTotal=Sum(VAT), netTotal=Sum('net'), grossTotal=Sum(GROSS)).order_by('bookingType')
+
+
+def close_period(company, start, end):
+    """
+    Closes the period of the company and stores the totals.
+    """
+    with transaction.atomic():
+        models.Company.objects.select_for_update().filter(pk=company.pk).first()
+        if models.ClosedPeriod.objects.filter(company=company, start__lte=end, end__gte=start).exists():
+            raise PermissionDenied(detail="The period overlaps a closed period")
+        totals = []
+        sums = {}
+        for kind, model in (('sale', models.Sale), ('purchase', models.Purchase)):
+            rows = _totals(model.objects.filter(
+                company=company, cashflowdate__range=[start, end]))
+            sums[kind] = [0.0, 0.0, 0.0]
+            for row in rows:
+                totals.append(models.ClosedPeriodTotal(
+                    kind=kind, bookingType=row['bookingType'], vat=row['vatTotal'],
+                    net=row['netTotal'], gross=row['grossTotal']))
+                sums[kind][0] += row['vatTotal']
+                sums[kind][1] += row['netTotal']
+                sums[kind][2] += row['grossTotal']
+        period = models.ClosedPeriod.objects.create(
+            company=company, start=start, end=end,
+            vatIn=sums['sale'][0], salesNet=sums['sale'][1], salesGross=sums['sale'][2],
+            vatOut=sums['purchase'][0], purchasesNet=sums['purchase'][1], purchasesGross=sums['purchase'][2])
+        for total in totals:
+            total.period = period
+        models.ClosedPeriodTotal.objects.bulk_create(totals)
+    return period
+
+
+def vat_totals(company, after, before, include_archived=False):
+    """
+    Returns vatIn and vatOut of the company within the time range.
+    Closed periods within the range are taken from their snapshot,
+    only the remaining (open) days are calculated from the bookings
+    (and the archived bookings, if include_archived is set).
+    """
+    periods = models.ClosedPeriod.objects.filter(
+        company=company, start__gte=after, end__lte=before)
+    vatIn = vatOut = 0.0
+    live = Q(company=company, cashflowdate__range=[after, before])
+    for period in periods:
+        vatIn += period.vatIn
+        vatOut += period.vatOut
+        live &= ~Q(cashflowdate__range=[period.start, period.end])
+    vatIn += models.Sale.objects.filter(live).aggregate(
+        total=Sum(VAT))['total'] or 0.0
+    vatOut += models.Purchase.objects.filter(live).aggregate(
+        total=Sum(VAT))['total'] or 0.0
+    if include_archived:
+        vatIn += archive.archived(models.Sale).filter(live).aggregate(
+            total=Sum(VAT))['total'] or 0.0
+        vatOut += archive.archived(models.Purchase).filter(live).aggregate(
+            total=Sum(VAT))['total'] or 0.0
+    return vatIn, vatOut
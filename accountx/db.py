@@ -0,0 +1,51 @@
+"""
+Database routing and connection settings.
+Read only requests (GET, HEAD, OPTIONS) read from the replica database (alias "replica"),
+everything else uses the primary (default) database. After a successful write, the user reads
+from the primary for a few seconds (a cache entry per user), so the user sees its own changes even
+if the replica lags. The entry has to be in a cache shared by all workers (see CACHES).
+Without a replica database all queries use the default database.
+The requests are marked by the ReplicaRoutingMiddleware (accountx/middleware.py), so this module
+is cheap to import for processes which only run commands.
+"""
+import threading
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+_state = threading.local()
+
+
+class ReadReplicaRouter:
+    """
+    Routes the reads of read only requests to the replica database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'use_replica', False) and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False
+        return None
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Applies the pragmas from ACCOUNTX_SQLITE_PRAGMAS (e.g. WAL mode, mmap size) to new SQLite connections.
+    Connected to connection_created by AccountxConfig.ready if pragmas are configured.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'ACCOUNTX_SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
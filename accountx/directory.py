@@ -0,0 +1,106 @@
+"""
+The member directory of the companies.
+The members of a company are the users of its admins and accountants groups, they are read with
+their role in a single query. The pages are cached per company (ACCOUNTX_MEMBERS_CACHE_TIMEOUT);
+every change of a membership or of a member bumps the version of the company (once the change
+is committed), which invalidates all its cached pages.
+The cache has to be shared by all workers (see CACHES), otherwise the other workers keep
+serving their stale pages until they expire.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, CharField, Max, Q, Value, When
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import models
+
+FIELDS = ['id', 'username', 'email', 'first_name', 'last_name']
+
+
+def members(company):
+    """
+    Returns the members of the company (values of FIELDS and role) ordered by id.
+    Members of both groups are admins ('admin' is the maximum of both roles).
+    """
+    role = Case(When(groups=company.admins_id, then=Value('admin')),
+                default=Value('accountant'), output_field=CharField())
+    return User.objects.filter(groups__in=[company.admins_id, company.accountants_id]).values(
+        *FIELDS).annotate(role=Max(role)).order_by('id')
+
+
+def _version_key(companyId):
+    return 'members-version:%s' % companyId
+
+
+def cache_key(companyId, *parts):
+    """
+    Returns the cache key of a page (identified by parts, e.g. cursor and page size) of the company.
+    """
+    # a new version starts at the current time, so pages of an evicted version are never reused
+    version = cache.get_or_set(_version_key(companyId), int(time.time() * 1000), None)
+    return 'members:%s:%s:%s' % (companyId, version, ':'.join(str(part) for part in parts))
+
+
+def timeout():
+    return getattr(settings, 'ACCOUNTX_MEMBERS_CACHE_TIMEOUT', 300)
+
+
+def _bump(companyIds):
+    for companyId in companyIds:
+        try:
+            cache.incr(_version_key(companyId))
+        except ValueError:
+            pass
+
+
+def invalidate(companyIds):
+    """
+    Invalidates the cached pages of the companies after the commit, so no request can cache
+    the old members again before the change is visible.
+    """
+    companyIds = set(companyIds)
+    transaction.on_commit(lambda: _bump(companyIds))
+
+
+def companies_of_groups(groupIds):
+    """
+    Returns the ids of the companies of the (admins or accountants) groups.
+    """
+    return models.Company.objects.filter(
+        Q(admins__in=groupIds) | Q(accountants__in=groupIds)).values_list('pk', flat=True)
+
+
+def _companies_of_users(userIds):
+    return companies_of_groups(User.groups.through.objects.filter(
+        user_id__in=userIds).values('group_id'))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def _memberships_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        groupIds = [instance.pk]
+    elif pk_set is None:
+        # the groups of a cleared user are only known before the clear
+        groupIds = list(instance.groups.values_list('pk', flat=True))
+    else:
+        groupIds = list(pk_set)
+    invalidate(companies_of_groups(groupIds))
+
+
+@receiver(post_save, sender=User)
+def _member_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidate(_companies_of_users([instance.pk]))
+
+
+@receiver(pre_delete, sender=User)
+def _member_deleted(sender, instance, **kwargs):
+    invalidate(_companies_of_users([instance.pk]))
@@ -0,0 +1,109 @@
+"""
+Detection of duplicate sales and purchases.
+Exact duplicates have the same normalized keys (purchases: biller and invoice number,
+sales: customer, net and invoice date). Near duplicates have the same net amount and an
+invoice date within a few days. Both are found with a single indexed query per booking.
+"""
+import datetime
+import re
+
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+
+from . import models
+
+EXACT_KEYS = {
+    models.Purchase: ['billerKey', 'invNoKey'],
+    models.Sale: ['customerKey', 'net', 'invDate'],
+}
+
+
+def normalize(value):
+    """
+    Returns the key of a text: only lower case letters and digits, leading zeros of numbers removed.
+    E.g. "INV-000123 " and "inv 123" have the same key.
+    """
+    key = ''.join(char for char in (value or '').casefold() if char.isalnum())
+    return re.sub(r'(?<!\d)0+(?=\d)', '', key)
+
+
+@receiver(pre_save, sender=models.Purchase)
+@receiver(pre_save, sender=models.Sale)
+def _set_keys_on_save(sender, instance, **kwargs):
+    set_keys(instance)
+
+
+def set_keys(booking):
+    """
+    Sets the normalized key columns of a sale or purchase.
+    This has to be called before bulk_create, on save it is done automatically.
+    """
+    if isinstance(booking, models.Purchase):
+        booking.billerKey = normalize(booking.biller)
+        booking.invNoKey = normalize(booking.invNo)
+    else:
+        booking.customerKey = normalize(booking.customer)
+
+
+def days():
+    return getattr(settings, 'ACCOUNTX_DUPLICATE_DAYS', 3)
+
+
+def _exact(booking):
+    return {name: getattr(booking, name) for name in EXACT_KEYS[type(booking)]}
+
+
+def find(booking, window=None):
+    """
+    Returns the ids of the exact and of the near duplicates of the (possibly unsaved) booking.
+    """
+    set_keys(booking)
+    window = datetime.timedelta(days=days() if window is None else window)
+    exact = _exact(booking)
+    rows = type(booking).objects.filter(
+        Q(**exact) | Q(net=booking.net, invDate__range=[booking.invDate - window, booking.invDate + window]),
+        company_id=booking.company_id)
+    if booking.pk is not None:
+        rows = rows.exclude(pk=booking.pk)
+    rows = rows.values('pk', *exact)
+    exactIds, nearIds = [], []
+    for row in rows:
+        if all(row[name] == value for name, value in exact.items()):
+            exactIds.append(row['pk'])
+        else:
+            nearIds.append(row['pk'])
+    return exactIds, nearIds
+
+
+def report(model, company, window=None):
+    """
+    Returns the groups (lists of ids) of exact and of near duplicates within the bookings of the company.
+    Each group is found in a single pass over the bookings ordered by the respective index.
+    """
+    window = datetime.timedelta(days=days() if window is None else window)
+    bookings = model.objects.filter(company=company)
+    keys = EXACT_KEYS[model]
+    exact = []
+    group, previous = [], None
+    for row in bookings.order_by(*keys, 'pk').values_list('pk', *keys):
+        if row[1:] != previous:
+            if len(group) > 1:
+                exact.append(group)
+            group, previous = [], row[1:]
+        group.append(row[0])
+    if len(group) > 1:
+        exact.append(group)
+    near = []
+    # a group spans at most the window from its first booking, so groups cannot chain
+    group, first = [], None
+    for pk, net, invDate in bookings.order_by('net', 'invDate', 'pk').values_list('pk', 'net', 'invDate'):
+        if first is None or net != first[0] or invDate - first[1] > window:
+            if len(group) > 1:
+                near.append(group)
+            group, first = [], (net, invDate)
+        group.append(pk)
+    if len(group) > 1:
+        near.append(group)
+    return exact, near
@@ -0,0 +1,160 @@
+"""
+Change events of the companies (create, update and delete of sales, purchases and media).
+Every change is written to the ChangeLog and published to the in-process hub once the
+transaction is committed. The event streams read from the hub and poll the ChangeLog
+for changes made by other processes.
+The ids of the ChangeLog are assigned on insert, but the entries become visible on commit, so a
+lower id can show up after a higher one. The streams therefore re-read the entries of the last
+REREAD_SECONDS on every poll (and after a reconnect), events are delivered at least once.
+Every stream occupies a worker thread while it is open (use threaded workers), the database
+connection is closed between the polls. Old entries are removed with "manage.py prune_changes".
+"""
+import datetime
+import json
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import models
+
+POLL_INTERVAL = 2
+REREAD_SECONDS = 60
+RETRY = 3000
+
+
+def stream_duration():
+    return getattr(settings, 'ACCOUNTX_EVENT_STREAM_SECONDS', 60)
+
+
+class EventHub:
+    """
+    A simple publish/subscribe hub. Every subscriber gets its own queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, company_id):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers.setdefault(company_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, company_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(company_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(company_id, None)
+
+    def publish(self, company_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(company_id, ()))
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+
+hub = EventHub()
+
+
+def _as_event(entry):
+    return {'id': entry.id, 'model': entry.model, 'object_id': entry.object_id, 'action': entry.action}
+
+
+def record_change(instance, action):
+    """
+    Writes the change of the instance to the ChangeLog and publishes it after the commit.
+    """
+    entry = models.ChangeLog.objects.create(
+        company_id=instance.company_id, model=instance._meta.model_name,
+        object_id=instance.pk, action=action)
+    transaction.on_commit(lambda: hub.publish(entry.company_id, _as_event(entry)))
+    return entry
+
+
+def record_changes(instances, action):
+    """
+    Like record_change, for many instances at once.
+    """
+    entries = [models.ChangeLog(
+        company_id=instance.company_id, model=instance._meta.model_name,
+        object_id=instance.pk, action=action) for instance in instances]
+    models.ChangeLog.objects.bulk_create(entries)
+    # the ids are only known on some databases, the streams read the others from the ChangeLog
+    published = [entry for entry in entries if entry.pk is not None]
+    transaction.on_commit(lambda: [hub.publish(entry.company_id, _as_event(entry)) for entry in published])
+    return entries
+
+
+def _format(event):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], event['action'], json.dumps(event))
+
+
+def _close_connection():
+    connection = connections[router.db_for_read(models.ChangeLog)]
+    if not connection.in_atomic_block:
+        connection.close()
+
+
+def event_stream(company_id, last_event_id=None):
+    """
+    Yields the server-sent events of a company.
+    Without a last event id (from the Last-Event-ID header) the stream starts with the next change,
+    otherwise with the changes after it and the changes of the last REREAD_SECONDS (which may have
+    been committed after it).
+    The stream ends after ACCOUNTX_EVENT_STREAM_SECONDS, the client reconnects automatically.
+    """
+    subscriber = hub.subscribe(company_id)
+    try:
+        changes = models.ChangeLog.objects.filter(company_id=company_id)
+        if last_event_id is None:
+            last = changes.order_by('-id').values_list('id', flat=True).first() or 0
+            reread = timezone.now()
+        else:
+            last = last_event_id
+            reread = None
+        _close_connection()
+        # delivered ids with the time they were delivered, kept as long as they can be read again
+        seen = {}
+        yield 'retry: %d\n\n' % RETRY
+        end = time.monotonic() + stream_duration()
+        next_poll = time.monotonic() + POLL_INTERVAL
+        while time.monotonic() < end:
+            try:
+                event = subscriber.get(
+                    timeout=max(0, next_poll - time.monotonic()))
+                if event['id'] not in seen:
+                    seen[event['id']] = time.monotonic()
+                    yield _format(event)
+            except queue.Empty:
+                pass
+            if time.monotonic() < next_poll:
+                continue
+            next_poll = time.monotonic() + POLL_INTERVAL
+            window = timezone.now() - datetime.timedelta(seconds=REREAD_SECONDS)
+            if reread is not None:
+                window = max(window, reread)
+            for entry in changes.filter(Q(id__gt=last) | Q(created_at__gte=window)).order_by('id'):
+                if entry.id not in seen:
+                    seen[entry.id] = time.monotonic()
+                    yield _format(_as_event(entry))
+                last = max(last, entry.id)
+            _close_connection()
+            expired = time.monotonic() - 2 * REREAD_SECONDS
+            seen = {eventId: delivered for eventId, delivered in seen.items() if delivered > expired}
+            yield ': keepalive\n\n'
+    finally:
+        hub.unsubscribe(company_id, subscriber)
+
+
+def prune(before):
+    """
+    Deletes the ChangeLog entries created before the given time. Returns the number of deleted entries.
+    """
+    return models.ChangeLog.objects.filter(created_at__lt=before).delete()[0]
@@ -0,0 +1,106 @@
+"""
+Instrumentation of the startup: the import time of every module.
+manage.py and swengs/wsgi.py install it before Django is loaded if ACCOUNTX_IMPORT_PROFILE is set.
+The slowest modules are reported once the application is loaded (WSGI) or on exit (manage.py):
+to stderr if ACCOUNTX_IMPORT_PROFILE is 1, otherwise appended as a JSON line to the file it names.
+The cumulative time of a module includes the modules it imports, the self time does not.
+Only modules loaded from files are measured (not builtin and frozen modules).
+This module must not import Django or anything of accountx.
+"""
+import atexit
+import json
+import os
+import sys
+import time
+from importlib.machinery import (ExtensionFileLoader, SourceFileLoader,
+                                 SourcelessFileLoader)
+
+TOP = 30
+
+_timer = None
+
+
+class ImportTimer:
+    """
+    A meta path finder which finds modules with the other finders and wraps the exec_module
+    of their (per module) loader to measure it.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.total = 0.0
+        self._stack = []
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if isinstance(spec.loader, (SourceFileLoader, SourcelessFileLoader, ExtensionFileLoader)):
+            spec.loader.exec_module = self._timed(fullname, spec.loader.exec_module)
+        return spec
+
+    def _timed(self, fullname, execute):
+        def exec_module(module):
+            self._stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                execute(module)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                else:
+                    self.total += elapsed
+                self.times[fullname] = (elapsed, elapsed - children)
+        return exec_module
+
+    def report(self, top):
+        """
+        Returns the total import time and the slowest modules (by cumulative time) in milliseconds.
+        """
+        modules = sorted(self.times.items(), key=lambda item: item[1][0], reverse=True)[:top]
+        return {
+            'total': round(self.total * 1000, 1),
+            'modules': len(self.times),
+            'slowest': [{'module': name, 'cumulative': round(cumulative * 1000, 1), 'self': round(own * 1000, 1)}
+                        for name, (cumulative, own) in modules],
+        }
+
+
+def install():
+    """
+    Starts measuring the imports (once) and reports them on exit.
+    """
+    global _timer
+    if _timer is None:
+        _timer = ImportTimer()
+        sys.meta_path.insert(0, _timer)
+        atexit.register(report)
+
+
+def report(label=None):
+    """
+    Writes the report of the imports so far (see the module docstring) and stops measuring.
+    """
+    global _timer
+    if _timer is None:
+        return
+    sys.meta_path.remove(_timer)
+    result = dict(_timer.report(TOP), process=label or ' '.join(sys.argv), pid=os.getpid())
+    _timer = None
+    target = os.environ.get('ACCOUNTX_IMPORT_PROFILE', '1')
+    if target == '1':
+        sys.stderr.write('Import time of %s: %.1f ms (%d modules)\n' % (
+            result['process'], result['total'], result['modules']))
+        sys.stderr.write('%12s %12s  %s\n' % ('cumulative', 'self', 'module'))
+        for entry in result['slowest']:
+            sys.stderr.write('%12.1f %12.1f  %s\n' % (entry['cumulative'], entry['self'], entry['module']))
+    else:
+        with open(target, 'a') as output:
+            output.write(json.dumps(result) + '\n')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accountx import archive, models
+
+
+class Command(BaseCommand):
+    help = 'Moves the sales and purchases of closed fiscal years into the archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('before', type=int,
+                            help='All closed fiscal years before this year are archived.')
+        parser.add_argument('--company', type=int,
+                            help='Only archive the years of this company.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the years which would be archived.')
+
+    def handle(self, *args, **options):
+        companies = models.Company.objects.order_by('pk')
+        if options['company'] is not None:
+            companies = companies.filter(pk=options['company'])
+            if not companies.exists():
+                raise CommandError('Company %s does not exist' % options['company'])
+        for company in companies:
+            years = models.Sale.objects.filter(
+                company=company, cashflowdate__year__lt=options['before']).dates('cashflowdate', 'year')
+            years = {date.year for date in years} | {date.year for date in models.Purchase.objects.filter(
+                company=company, cashflowdate__year__lt=options['before']).dates('cashflowdate', 'year')}
+            for year in sorted(years):
+                if not archive.year_closed(company, year):
+                    self.stdout.write('%s %d: not closed, skipped' % (company, year))
+                    continue
+                if options['dry_run']:
+                    self.stdout.write('%s %d: would be archived' % (company, year))
+                    continue
+                sales, purchases = archive.archive_year(company, year)
+                self.stdout.write(self.style.SUCCESS(
+                    '%s %d: archived %d sales and %d purchases' % (company, year, sales, purchases)))
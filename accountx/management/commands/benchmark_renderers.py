@@ -0,0 +1,72 @@
+import datetime
+import gzip
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from accountx import models, renderers, serializers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _synthetic_sales(count):
+    """
+    Returns rows shaped like the sale list output.
+    """
+    start = datetime.date(2015, 1, 1)
+    now = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    return [{
+        'id': i, 'gross': i * 1.2, 'invNo': '2015%d' % i, 'bookingType': 'Consulting',
+        'invDate': start + datetime.timedelta(days=i % 3650), 'customer': 'Customer %d' % (i % 50),
+        'project': 'Project %d' % (i % 20), 'vat': 0.2, 'net': float(i), 'notes': None,
+        'cashflowdate': start + datetime.timedelta(days=i % 3650 + 30),
+        'created_at': now, 'updated_at': now, 'company': 1, 'invoice': [i, i + 1],
+    } for i in range(count)]
+
+
+class Command(BaseCommand):
+    help = 'Compares encoding time and payload size of the renderers on the sale and purchase lists.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Number of synthetic sales (if no company is given).')
+        parser.add_argument('--company', type=int,
+                            help='Use the sales and purchases of this company instead of synthetic data.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['company'] is not None:
+            sales = models.Sale.objects.filter(
+                company=options['company']).prefetch_related('invoice')
+            purchases = models.Purchase.objects.filter(
+                company=options['company']).prefetch_related('invoice')
+            payloads = {
+                'sales': serializers.SaleSerializer(sales, many=True).data,
+                'purchases': serializers.PurchaseSerializer(purchases, many=True).data,
+            }
+        else:
+            payloads = {'sales (synthetic)': _synthetic_sales(options['rows'])}
+        candidates = [('JSONRenderer', JSONRenderer())]
+        if renderers.orjson is not None:
+            candidates.append(('FastJSONRenderer', renderers.FastJSONRenderer()))
+        if renderers.msgpack is not None:
+            candidates.append(('MessagePackRenderer', renderers.MessagePackRenderer()))
+        if len(candidates) == 1:
+            raise CommandError('Neither orjson nor msgpack is installed')
+        self.stdout.write('%-20s %-20s %8s %10s %10s %10s %10s' % (
+            'payload', 'renderer', 'rows', 'ms', 'bytes', 'gzip', 'br'))
+        for name, data in payloads.items():
+            for rendererName, renderer in candidates:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    content = renderer.render(data)
+                    timings.append(time.perf_counter() - started)
+                self.stdout.write('%-20s %-20s %8d %10.2f %10d %10d %10s' % (
+                    name, rendererName, len(data), min(timings) * 1000, len(content),
+                    len(gzip.compress(content)),
+                    len(brotli.compress(content, quality=5)) if brotli else '-'))
@@ -0,0 +1,347 @@
+import datetime
+import json
+import logging
+import multiprocessing
+import random
+import sys
+import threading
+import time
+import uuid
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import Group, User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from rest_framework.settings import api_settings
+
+from accountx import models
+
+PASSWORD = 'loadtest'
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Client:
+    """
+    Calls the WSGI application directly (no network) and records the latency of every request
+    by endpoint name.
+    """
+
+    def __init__(self, application, multiprocess):
+        self.application = application
+        self.multiprocess = multiprocess
+        self.token = None
+        self.samples = {}
+
+    def request(self, name, method, path, query=None, data=None, files=None):
+        if files:
+            body = encode_multipart(BOUNDARY, dict(data or {}, **files))
+            contentType = MULTIPART_CONTENT
+        else:
+            body = json.dumps(data).encode() if data is not None else b''
+            contentType = 'application/json'
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'SCRIPT_NAME': '',
+            'QUERY_STRING': urlencode(query or {}), 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1', 'HTTP_HOST': 'localhost',
+            'HTTP_ACCEPT': 'application/json', 'CONTENT_TYPE': contentType,
+            'CONTENT_LENGTH': str(len(body)), 'wsgi.input': BytesIO(body), 'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.multithread': True,
+            'wsgi.multiprocess': self.multiprocess, 'wsgi.run_once': False,
+        }
+        if self.token:
+            environ['HTTP_AUTHORIZATION'] = 'Bearer ' + self.token
+        status = []
+        started = time.perf_counter()
+        response = self.application(environ, lambda code, headers, exc_info=None: status.append((code, headers)))
+        try:
+            content = b''.join(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        elapsed = time.perf_counter() - started
+        code = int(status[0][0].split()[0])
+        self.samples.setdefault(name, []).append((elapsed, code >= 400))
+        responseType = dict(status[0][1]).get('Content-Type', '')
+        if code >= 400 or not responseType.startswith('application/json'):
+            return code, None
+        try:
+            return code, json.loads(content)
+        except ValueError:
+            return code, None
+
+
+class Scenario:
+    """
+    The request mix of a user of a company: sales and purchases (list, create, retrieve, update,
+    delete), media upload and download, the vat report and the token authentication.
+    """
+
+    def __init__(self, client, username, company, seed):
+        self.client = client
+        self.username = username
+        self.company = company
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.counter = 0
+        self.created = {'sales': [], 'purchases': [], 'media': []}
+        self.mix = [
+            (self.token, 1),
+            (self.list_sales, 15),
+            (self.list_purchases, 10),
+            (self.create_sale, 8),
+            (self.create_purchase, 8),
+            (self.retrieve, 15),
+            (self.update, 6),
+            (self.delete, 3),
+            (self.upload_media, 2),
+            (self.download_media, 4),
+            (self.vat_report, 5),
+        ]
+
+    def step(self):
+        operations, weights = zip(*self.mix)
+        self.random.choices(operations, weights)[0]()
+
+    def token(self):
+        status, body = self.client.request('POST /api-token-auth/', 'POST', '/api-token-auth/', data={
+            'username': self.username, 'password': PASSWORD})
+        if body:
+            self.client.token = body['token']
+
+    def list_sales(self):
+        self.client.request('GET /sales/', 'GET', '/sales/', {'company': self.company})
+
+    def list_purchases(self):
+        self.client.request('GET /purchases/', 'GET', '/purchases/', {'company': self.company})
+
+    def _booking(self):
+        self.counter += 1
+        invDate = datetime.date(2019, 1, 1) + datetime.timedelta(days=self.random.randrange(365))
+        return {
+            'company': self.company, 'bookingType': self.random.choice(['Consulting', 'Hardware', 'Travel']),
+            'invDate': invDate.isoformat(), 'vat': self.random.choice([0.1, 0.2]),
+            'net': round(self.random.uniform(10, 5000), 2), 'cashflowdate': None, 'invoice': [],
+        }
+
+    def _data(self, kind):
+        if kind == 'sales':
+            return dict(self._booking(), customer='Customer %d-%d' % (self.seed, self.counter), project='Load test')
+        return dict(self._booking(), biller='Biller %d' % self.random.randrange(20),
+                    invNo='LT-%d-%d' % (self.seed, self.counter))
+
+    def _create(self, kind):
+        status, body = self.client.request('POST /%s/' % kind, 'POST', '/%s/' % kind, data=self._data(kind))
+        if body:
+            self.created[kind].append(body['id'])
+
+    def create_sale(self):
+        self._create('sales')
+
+    def create_purchase(self):
+        self._create('purchases')
+
+    def _pick(self):
+        kinds = [kind for kind in ('sales', 'purchases') if self.created[kind]]
+        if not kinds:
+            return None, None
+        kind = self.random.choice(kinds)
+        return kind, self.random.choice(self.created[kind])
+
+    def retrieve(self):
+        kind, pk = self._pick()
+        if kind is None:
+            return self.create_sale()
+        self.client.request('GET /%s/{id}/' % kind, 'GET', '/%s/%d/' % (kind, pk))
+
+    def update(self):
+        kind, pk = self._pick()
+        if kind is None:
+            return self.create_purchase()
+        data = dict(self._data(kind), notes='Updated %d' % self.random.randrange(1000))
+        self.client.request('PUT /%s/{id}/' % kind, 'PUT', '/%s/%d/' % (kind, pk), data=data)
+
+    def delete(self):
+        kind, pk = self._pick()
+        if kind is None:
+            return self.create_sale()
+        self.created[kind].remove(pk)
+        self.client.request('DELETE /%s/{id}/' % kind, 'DELETE', '/%s/%d/' % (kind, pk))
+
+    def upload_media(self):
+        content = ContentFile(b'%PDF-1.4 load test invoice\n' * 200, name='invoice.pdf')
+        status, body = self.client.request('POST /media/', 'POST', '/media/', data={'company': self.company},
+                                           files={'file': content})
+        if body:
+            self.created['media'].append(body['id'])
+
+    def download_media(self):
+        if not self.created['media']:
+            return self.upload_media()
+        pk = self.random.choice(self.created['media'])
+        self.client.request('GET /media/{id}/', 'GET', '/media/%d/' % pk)
+
+    def vat_report(self):
+        year = self.random.choice([2019, 2020])
+        self.client.request('GET /vatReport/', 'GET', '/vatReport/', {
+            'cid': self.company, 'after': '%d-01-01' % year, 'before': '%d-12-31' % year})
+
+
+def _run_threads(application, username, company, token, threads, duration, seed, multiprocess):
+    """
+    Runs the scenario in the given number of threads for duration seconds.
+    Returns the samples of all threads.
+    """
+    clients = []
+    deadline = time.perf_counter() + duration
+
+    def work(index):
+        client = Client(application, multiprocess)
+        client.token = token
+        clients.append(client)
+        scenario = Scenario(client, username, company, seed * 1000 + index)
+        try:
+            while time.perf_counter() < deadline:
+                scenario.step()
+        finally:
+            connections.close_all()
+
+    workers = [threading.Thread(target=work, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    samples = {}
+    for client in clients:
+        for name, values in client.samples.items():
+            samples.setdefault(name, []).extend(values)
+    return samples
+
+
+def _run_process(args):
+    from swengs.wsgi import application
+    return _run_threads(application, *args, multiprocess=True)
+
+
+def summarize(samples, elapsed):
+    """
+    Returns the statistics (requests/second, latency percentiles in ms, error rate) per endpoint
+    and in total.
+    """
+    endpoints = {}
+    for name, values in sorted(samples.items()):
+        latencies = sorted(value[0] * 1000 for value in values)
+        errors = sum(1 for value in values if value[1])
+        endpoints[name] = {
+            'requests': len(values),
+            'rps': round(len(values) / elapsed, 2),
+            'p50': round(_percentile(latencies, 0.5), 2),
+            'p95': round(_percentile(latencies, 0.95), 2),
+            'p99': round(_percentile(latencies, 0.99), 2),
+            'errorRate': round(errors / len(values), 4),
+        }
+    allSamples = [value for values in samples.values() for value in values]
+    latencies = sorted(value[0] * 1000 for value in allSamples) or [0.0]
+    total = {
+        'requests': len(allSamples),
+        'rps': round(len(allSamples) / elapsed, 2),
+        'p50': round(_percentile(latencies, 0.5), 2),
+        'p95': round(_percentile(latencies, 0.95), 2),
+        'p99': round(_percentile(latencies, 0.99), 2),
+        'errorRate': round(sum(1 for value in allSamples if value[1]) / (len(allSamples) or 1), 4),
+    }
+    return total, endpoints
+
+
+class Command(BaseCommand):
+    help = ('Load tests the WSGI application (swengs/wsgi.py) in process with a realistic mix of JWT '
+            'authenticated requests and prints the statistics per endpoint as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Threads (per process).')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Processes (forked, more than one needs fork support).')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Duration of the run in seconds.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep the API throttling enabled (it is disabled for the run by default).')
+        parser.add_argument('--keep', action='store_true',
+                            help='Keep the load test user, company and bookings.')
+        parser.add_argument('--output',
+                            help='Append the result as a JSON line to this file, to compare runs over time.')
+
+    def handle(self, *args, **options):
+        from swengs.wsgi import application
+
+        threads, processes = options['threads'], options['processes']
+        if threads < 1 or processes < 1:
+            raise CommandError('--threads and --processes have to be at least 1')
+        if processes > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            raise CommandError('Multiple processes need fork support')
+        if not options['throttle']:
+            api_settings.DEFAULT_THROTTLE_RATES = {}
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        name = 'loadtest-%s' % uuid.uuid4().hex[:8]
+        setup = Client(application, processes > 1)
+        status, _ = setup.request('setup', 'POST', '/users/', data={'username': name, 'password': PASSWORD})
+        status, body = setup.request('setup', 'POST', '/api-token-auth/', data={
+            'username': name, 'password': PASSWORD})
+        if body is None:
+            raise CommandError('Authentication of the load test user failed (%d)' % status)
+        setup.token = body['token']
+        status, body = setup.request('setup', 'POST', '/companies/', data={'name': name})
+        if body is None:
+            raise CommandError('Creation of the load test company failed (%d)' % status)
+        company = body['id']
+
+        args = (name, company, setup.token, threads, options['duration'])
+        startedAt = datetime.datetime.now(datetime.timezone.utc)
+        started = time.perf_counter()
+        try:
+            if processes > 1:
+                connections.close_all()
+                with multiprocessing.get_context('fork').Pool(processes) as pool:
+                    results = pool.map(_run_process, [args + (options['seed'] + index,)
+                                                      for index in range(processes)])
+            else:
+                results = [_run_threads(application, *args, options['seed'], multiprocess=False)]
+            elapsed = time.perf_counter() - started
+        finally:
+            if not options['keep']:
+                self._cleanup(company)
+        samples = {}
+        for result in results:
+            for endpoint, values in result.items():
+                samples.setdefault(endpoint, []).extend(values)
+        total, endpoints = summarize(samples, elapsed)
+        report = {
+            'started': startedAt.isoformat(),
+            'threads': threads, 'processes': processes, 'duration': round(elapsed, 2),
+            'throttle': options['throttle'], 'total': total, 'endpoints': endpoints,
+        }
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                output.write(json.dumps(report) + '\n')
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def _cleanup(self, companyId):
+        """
+        Deletes the load test company (with its bookings, media and groups) and user.
+        """
+        company = models.Company.objects.get(pk=companyId)
+        for pk in models.Media.objects.filter(company=company).values_list('pk', flat=True):
+            default_storage.delete('media/' + str(pk))
+        users = list(User.objects.filter(groups=company.admins).values_list('pk', flat=True))
+        groups = [company.admins_id, company.accountants_id]
+        company.delete()
+        User.objects.filter(pk__in=users).delete()
+        Group.objects.filter(pk__in=groups).delete()
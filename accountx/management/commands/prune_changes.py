@@ -0,0 +1,19 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accountx import events
+
+
+class Command(BaseCommand):
+    help = 'Deletes the entries of the change log (event streams) which are older than the given days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'ACCOUNTX_CHANGELOG_DAYS', 7),
+                            help='Entries older than this many days are deleted (default ACCOUNTX_CHANGELOG_DAYS).')
+
+    def handle(self, *args, **options):
+        deleted = events.prune(timezone.now() - datetime.timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS('Deleted %d change log entries' % deleted))
@@ -0,0 +1,139 @@
+import base64
+import re
+
+import jwt
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+from rest_framework.authentication import get_authorization_header
+from rest_framework_jwt.settings import api_settings as jwt_settings
+
+from .db import REPLICA, _state
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+re_accepts_brotli = re.compile(r'\bbr\b')
+
+# Only text and structured data compress well, media files (PDFs, images) usually are compressed already.
+COMPRESSIBLE_TYPES = ('application/json', 'application/msgpack', 'application/javascript', 'application/xml')
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compresses large text and JSON/MessagePack responses with brotli (if installed and accepted
+    by the client) or gzip. Responses smaller than ACCOUNTX_COMPRESSION_MIN_SIZE, other content
+    types (e.g. media downloads) and streaming responses (e.g. the event streams) are not compressed.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        contentType = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not (contentType.startswith('text/') or contentType in COMPRESSIBLE_TYPES
+                or contentType.endswith('+json')):
+            return response
+        if len(response.content) < getattr(settings, 'ACCOUNTX_COMPRESSION_MIN_SIZE', 1024):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        acceptEncoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if brotli is not None and re_accepts_brotli.search(acceptEncoding):
+            content = brotli.compress(response.content, quality=5)
+            encoding = 'br'
+        elif re_accepts_gzip.search(acceptEncoding):
+            content = compress_string(response.content)
+            encoding = 'gzip'
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Adds the usage of the most used throttle bucket of the request (see accountx.throttling)
+    as X-RateLimit-* headers. Reset is the number of seconds until the bucket is full again.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        usage = getattr(request, 'throttle_usage', None)
+        if usage is not None:
+            response['X-RateLimit-Scope'] = usage['scope']
+            response['X-RateLimit-Limit'] = str(usage['limit'])
+            response['X-RateLimit-Remaining'] = str(usage['remaining'])
+            response['X-RateLimit-Reset'] = str(usage['reset'])
+        return response
+
+
+def _sticky_key(username):
+    return 'db-primary:%s' % username
+
+
+def request_username(request):
+    """
+    Returns the username of the user of the request (session, JWT or basic authentication) without
+    querying the database, or None. The credentials are verified later by the authentication of the view.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.get_username()
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2:
+        return None
+    if auth[0].lower() == jwt_settings.JWT_AUTH_HEADER_PREFIX.lower().encode():
+        try:
+            return jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(jwt_settings.JWT_DECODE_HANDLER(auth[1]))
+        except jwt.InvalidTokenError:
+            return None
+    if auth[0].lower() == b'basic':
+        try:
+            return base64.b64decode(auth[1]).decode().partition(':')[0]
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks read only requests for the ReadReplicaRouter and makes the user sticky to the
+    primary after a successful write.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if REPLICA not in settings.DATABASES:
+            return self.get_response(request)
+        if request.method in SAFE_METHODS:
+            username = request_username(request)
+            _state.use_replica = username is None or not cache.get(_sticky_key(username))
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.use_replica = False
+        # the view has authenticated the user (DRF sets it on the request)
+        user = getattr(request, 'user', None)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and user is not None \
+                and user.is_authenticated:
+            cache.set(_sticky_key(user.get_username()), True,
+                      getattr(settings, 'ACCOUNTX_REPLICA_STICKY_SECONDS', 5))
+        return response
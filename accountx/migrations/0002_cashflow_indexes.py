@@ -0,0 +1,21 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountx', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['company', 'cashflowdate'], name='accountx_pu_company_c54ce5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', 'cashflowdate'], name='accountx_sa_company_138763_idx'),
+        ),
+    ]
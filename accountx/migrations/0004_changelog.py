@@ -0,0 +1,29 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountx', '0003_delta_sync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.TextField()),
+                ('object_id', models.PositiveIntegerField()),
+                ('action', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accountx.Company')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['company', 'id'], name='accountx_ch_company_e4120a_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountx', '0004_changelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClosedPeriod',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateField()),
+                ('end', models.DateField()),
+                ('vatIn', models.FloatField()),
+                ('vatOut', models.FloatField()),
+                ('salesNet', models.FloatField()),
+                ('salesGross', models.FloatField()),
+                ('purchasesNet', models.FloatField()),
+                ('purchasesGross', models.FloatField()),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='accountx.Company')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClosedPeriodTotal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.TextField()),
+                ('bookingType', models.TextField()),
+                ('vat', models.FloatField()),
+                ('net', models.FloatField()),
+                ('gross', models.FloatField()),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='totals', to='accountx.ClosedPeriod')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='closedperiod',
+            index=models.Index(fields=['company', 'start', 'end'], name='accountx_cl_company_2ee290_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountx', '0005_closed_periods'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSale',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('bookingType', models.TextField()),
+                ('invDate', models.DateField()),
+                ('customer', models.TextField()),
+                ('project', models.TextField()),
+                ('vat', models.FloatField()),
+                ('net', models.FloatField()),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('cashflowdate', models.DateField(null=True)),
+                ('invoice', models.TextField(default='[]')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='accountx.Company')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedPurchase',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('bookingType', models.TextField()),
+                ('invNo', models.TextField()),
+                ('invDate', models.DateField()),
+                ('biller', models.TextField()),
+                ('vat', models.FloatField()),
+                ('net', models.FloatField()),
+                ('cashflowdate', models.DateField(null=True)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('invoice', models.TextField(default='[]')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='accountx.Company')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedsale',
+            index=models.Index(fields=['company', 'cashflowdate'], name='accountx_ar_company_6a08f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedpurchase',
+            index=models.Index(fields=['company', 'cashflowdate'], name='accountx_ar_company_1049d9_idx'),
+        ),
+    ]
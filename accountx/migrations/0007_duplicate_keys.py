@@ -0,0 +1,62 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:34
+
+import re
+
+from django.db import migrations, models
+
+
+def normalize(value):
+    key = ''.join(char for char in (value or '').casefold() if char.isalnum())
+    return re.sub(r'(?<!\d)0+(?=\d)', '', key)
+
+
+def fill_keys(apps, schema_editor):
+    Purchase = apps.get_model('accountx', 'Purchase')
+    Sale = apps.get_model('accountx', 'Sale')
+    for purchase in Purchase.objects.only('biller', 'invNo').iterator():
+        Purchase.objects.filter(pk=purchase.pk).update(
+            billerKey=normalize(purchase.biller), invNoKey=normalize(purchase.invNo))
+    for sale in Sale.objects.only('customer').iterator():
+        Sale.objects.filter(pk=sale.pk).update(customerKey=normalize(sale.customer))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountx', '0006_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='billerKey',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='invNoKey',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='customerKey',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['company', 'billerKey', 'invNoKey'], name='accountx_pu_company_7ff67d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['company', 'net', 'invDate'], name='accountx_pu_company_8e1df8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', 'customerKey', 'net', 'invDate'], name='accountx_sa_company_800e6e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', 'net', 'invDate'], name='accountx_sa_company_5cc550_idx'),
+        ),
+    ]
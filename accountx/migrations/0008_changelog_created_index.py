@@ -0,0 +1,17 @@
+# Generated by Django 2.2.8 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accountx', '0007_duplicate_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['company', 'created_at'], name='accountx_ch_company_5da641_idx'),
+        ),
+    ]
@@ -26,11 +26,17 @@ class Media(models.Model):
     content_type = models.TextField()
     size = models.PositiveIntegerField()
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'updated_at'])]
 
 
 class Sale(models.Model):
     """
     This class represents a sale of a company. It can be modified by the accountants or the admins.
+    customerKey is the normalized customer used for the duplicate detection (see duplicates.py).
     """
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     bookingType = models.TextField()
@@ -42,6 +48,15 @@ class Sale(models.Model):
     notes = models.TextField(blank=True, null=True)
     cashflowdate = models.DateField(null=True)
     invoice = models.ManyToManyField('Media', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    customerKey = models.TextField(default='', editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'cashflowdate']),
+                   models.Index(fields=['company', 'updated_at']),
+                   models.Index(fields=['company', 'customerKey', 'net', 'invDate']),
+                   models.Index(fields=['company', 'net', 'invDate'])]
 
     def __str__(self):
         return str(self.invDate.year) + str(self.pk)
@@ -50,6 +65,8 @@ class Sale(models.Model):
 class Purchase(models.Model):
     """
     This class represents a purchase of a company. It can be modified by the accountants or the admins.
+    billerKey and invNoKey are the normalized biller and invoice number used for the duplicate detection
+    (see duplicates.py).
     """
     company = models.ForeignKey(Company, on_delete=models.CASCADE)
     bookingType = models.TextField()
@@ -61,6 +78,133 @@ class Purchase(models.Model):
     cashflowdate = models.DateField(null=True)
     notes = models.TextField(blank=True, null=True)
     invoice = models.ManyToManyField('Media', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    billerKey = models.TextField(default='', editable=False)
+    invNoKey = models.TextField(default='', editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'cashflowdate']),
+                   models.Index(fields=['company', 'updated_at']),
+                   models.Index(fields=['company', 'billerKey', 'invNoKey']),
+                   models.Index(fields=['company', 'net', 'invDate'])]
 
     def __str__(self):
         return self.invNo
+
+
+class Tombstone(models.Model):
+    """
+    This class records the deletion of a Sale, Purchase or Media.
+    It is used by the delta sync of the list endpoints to tell the clients which objects are gone.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    model = models.TextField()
+    object_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'model', 'deleted_at'])]
+
+
+class ChangeLog(models.Model):
+    """
+    This class records every change (create, update, delete) of a Sale, Purchase or Media.
+    It feeds the event stream of a company across processes.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    model = models.TextField()
+    object_id = models.PositiveIntegerField()
+    action = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'id']),
+                   models.Index(fields=['company', 'created_at'])]
+
+
+class ClosedPeriod(models.Model):
+    """
+    This class represents a closed (filed) period of a company.
+    Sales and purchases with a cashflow date within the period cannot be changed anymore,
+    so the totals are calculated once when the period is closed.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    start = models.DateField()
+    end = models.DateField()
+    vatIn = models.FloatField()
+    vatOut = models.FloatField()
+    salesNet = models.FloatField()
+    salesGross = models.FloatField()
+    purchasesNet = models.FloatField()
+    purchasesGross = models.FloatField()
+    closed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'start', 'end'])]
+
+
+class ClosedPeriodTotal(models.Model):
+    """
+    This class represents the totals of a closed period per bookingType,
+    either for the sales or for the purchases (kind).
+    """
+    period = models.ForeignKey(
+        ClosedPeriod, on_delete=models.CASCADE, related_name="totals")
+    kind = models.TextField()
+    bookingType = models.TextField()
+    vat = models.FloatField()
+    net = models.FloatField()
+    gross = models.FloatField()
+
+
+class ArchivedSale(models.Model):
+    """
+    This class represents a sale of a closed fiscal year which was moved out of the Sale table.
+    The id of the sale is kept. Archived sales cannot be modified, they are visible to everyone
+    who can view the company. Since the archive can live in a separate database, the invoices
+    are stored as a list of media ids.
+    """
+    id = models.IntegerField(primary_key=True)
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, db_constraint=False)
+    bookingType = models.TextField()
+    invDate = models.DateField()
+    customer = models.TextField()
+    project = models.TextField()
+    vat = models.FloatField()
+    net = models.FloatField()
+    notes = models.TextField(blank=True, null=True)
+    cashflowdate = models.DateField(null=True)
+    invoice = models.TextField(default='[]')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'cashflowdate'])]
+
+
+class ArchivedPurchase(models.Model):
+    """
+    This class represents a purchase of a closed fiscal year which was moved out of the Purchase table.
+    See ArchivedSale.
+    """
+    id = models.IntegerField(primary_key=True)
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, db_constraint=False)
+    bookingType = models.TextField()
+    invNo = models.TextField()
+    invDate = models.DateField()
+    biller = models.TextField()
+    vat = models.FloatField()
+    net = models.FloatField()
+    cashflowdate = models.DateField(null=True)
+    notes = models.TextField(blank=True, null=True)
+    invoice = models.TextField(default='[]')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['company', 'cashflowdate'])]
@@ -0,0 +1,82 @@
+"""
+Creation of users with their groups and permissions.
+All rows (users, group memberships, global and object permissions) are inserted in bulk,
+so the number of queries does not depend on the number of users.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from . import directory, models
+from .permissions import permission_ids
+
+HASH_WORKERS = 4
+
+# Global permissions of users created by a company admin (accountants).
+ACCOUNTANT_PERMISSIONS = [
+    'accountx.add_sale', 'accountx.change_sale', 'accountx.delete_sale',
+    'accountx.add_purchase', 'accountx.change_purchase', 'accountx.delete_purchase',
+    'accountx.add_media', 'accountx.delete_media',
+]
+
+# Global permissions of users who registered themselves (they can create companies).
+REGISTERED_PERMISSIONS = [
+    'accountx.add_company', 'accountx.change_company', 'accountx.delete_company',
+    'accountx.add_sale', 'accountx.change_sale', 'accountx.delete_sale',
+    'accountx.add_purchase', 'accountx.change_purchase', 'accountx.delete_purchase',
+    'accountx.add_media', 'accountx.change_media', 'accountx.delete_media',
+]
+
+USER_PERMISSIONS = ['auth.change_user', 'auth.view_user', 'auth.delete_user']
+
+
+def create_users(entries, permissions):
+    """
+    Creates a user for every entry (dict with username, password and optionally email,
+    first_name, last_name and groups) and assigns the given global permissions.
+    The user can change itself, and the admins of every company the user is an accountant of
+    can change the user.
+    """
+    # hashing is by far the most expensive part, hashlib releases the GIL while hashing
+    with ThreadPoolExecutor(HASH_WORKERS) as executor:
+        passwords = list(executor.map(
+            make_password, [entry.get('password') for entry in entries]))
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(username=entry['username'], email=entry.get('email', ''),
+                 first_name=entry.get('first_name', ''), last_name=entry.get('last_name', ''),
+                 password=password)
+            for entry, password in zip(entries, passwords)])
+        created = User.objects.in_bulk(
+            [entry['username'] for entry in entries], field_name='username')
+        users = [created[entry['username']] for entry in entries]
+        groupIds = {user.pk: [group.pk for group in entry.get('groups', [])]
+                    for user, entry in zip(users, entries)}
+        admins = dict(models.Company.objects.filter(
+            accountants__in={pk for pks in groupIds.values() for pk in pks}).values_list('accountants_id', 'admins_id'))
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=user.pk, group_id=groupId)
+            for user in users for groupId in groupIds[user.pk]])
+        # bulk_create sends no m2m_changed signals
+        directory.invalidate(directory.companies_of_groups(
+            {pk for pks in groupIds.values() for pk in pks}))
+        User.user_permissions.through.objects.bulk_create([
+            User.user_permissions.through(user_id=user.pk, permission_id=permissionId)
+            for user in users for permissionId in permission_ids(*permissions)])
+        contentType = ContentType.objects.get_for_model(User)
+        userPermissions = permission_ids(*USER_PERMISSIONS)
+        UserObjectPermission.objects.bulk_create([
+            UserObjectPermission(user_id=user.pk, permission_id=permissionId,
+                                 content_type=contentType, object_pk=str(user.pk))
+            for user in users for permissionId in userPermissions])
+        GroupObjectPermission.objects.bulk_create([
+            GroupObjectPermission(group_id=adminsId, permission_id=permissionId,
+                                  content_type=contentType, object_pk=str(user.pk))
+            for user in users
+            for adminsId in {admins[pk] for pk in groupIds[user.pk] if pk in admins}
+            for permissionId in userPermissions])
+    return users
@@ -1,3 +1,4 @@
+from django.contrib.auth.models import Permission
 from rest_framework import permissions
 
 
@@ -15,3 +16,24 @@ class CustomObjectPermissions(permissions.DjangoObjectPermissions):
         'PATCH': ['%(app_label)s.change_%(model_name)s'],
         'DELETE': ['%(app_label)s.delete_%(model_name)s'],
     }
+
+
+_permission_ids = {}
+
+
+def permission_ids(*names):
+    """
+    Returns the ids of the given global permissions (e.g. "accountx.add_sale").
+    All permissions are loaded once per process, see clear_permission_ids.
+    """
+    if not _permission_ids:
+        for pk, app_label, codename in Permission.objects.values_list('pk', 'content_type__app_label', 'codename'):
+            _permission_ids['%s.%s' % (app_label, codename)] = pk
+    return [_permission_ids[name] for name in names]
+
+
+def clear_permission_ids(**kwargs):
+    """
+    The permissions are recreated by migrate (e.g. on a new test database), so the ids are reloaded.
+    """
+    _permission_ids.clear()
@@ -0,0 +1,72 @@
+"""
+Provisioning of companies.
+A company has an admins and an accountants group. The creating user becomes a member of both,
+the admins can change and delete both groups and the company, the accountants can view it.
+All rows (groups, companies, memberships and object permissions) are inserted in bulk within one
+transaction, so the number of queries does not depend on the number of companies and a failure
+never leaves groups without their company.
+"""
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from guardian.models import GroupObjectPermission
+
+from . import models
+from .permissions import permission_ids
+
+ADMINS = '%s Admins'
+ACCOUNTANTS = '%s Accountants'
+
+# Object permissions on the company: permission -> (admins, accountants)
+COMPANY_PERMISSIONS = {
+    'accountx.view_company': (True, True),
+    'accountx.change_company': (True, False),
+    'accountx.delete_company': (True, False),
+}
+
+# Object permissions of the admins on both groups of the company.
+GROUP_PERMISSIONS = ['auth.change_group', 'auth.delete_group']
+
+
+def group_names(name):
+    return [ADMINS % name, ACCOUNTANTS % name]
+
+
+def create_companies(entries, user):
+    """
+    Creates a company for every entry (dict with name and optionally description)
+    with its groups and permissions. Returns the companies.
+    """
+    names = [entry['name'] for entry in entries]
+    with transaction.atomic():
+        Group.objects.bulk_create([
+            Group(name=groupName) for name in names for groupName in group_names(name)])
+        groups = Group.objects.in_bulk(
+            [groupName for name in names for groupName in group_names(name)], field_name='name')
+        models.Company.objects.bulk_create([
+            models.Company(name=entry['name'], description=entry.get('description'),
+                           admins=groups[ADMINS % entry['name']],
+                           accountants=groups[ACCOUNTANTS % entry['name']])
+            for entry in entries])
+        created = models.Company.objects.in_bulk(names, field_name='name')
+        companies = [created[name] for name in names]
+        User.groups.through.objects.bulk_create([
+            User.groups.through(user_id=user.pk, group_id=groupId)
+            for company in companies for groupId in (company.admins_id, company.accountants_id)])
+        companyType = ContentType.objects.get_for_model(models.Company)
+        groupType = ContentType.objects.get_for_model(Group)
+        rows = []
+        for company in companies:
+            for name, permissionId in zip(COMPANY_PERMISSIONS, permission_ids(*COMPANY_PERMISSIONS)):
+                admins, accountants = COMPANY_PERMISSIONS[name]
+                for groupId in [company.admins_id] * admins + [company.accountants_id] * accountants:
+                    rows.append(GroupObjectPermission(
+                        group_id=groupId, permission_id=permissionId,
+                        content_type=companyType, object_pk=str(company.pk)))
+            for permissionId in permission_ids(*GROUP_PERMISSIONS):
+                for groupId in (company.admins_id, company.accountants_id):
+                    rows.append(GroupObjectPermission(
+                        group_id=company.admins_id, permission_id=permissionId,
+                        content_type=groupType, object_pk=str(groupId)))
+        GroupObjectPermission.objects.bulk_create(rows)
+    return companies
@@ -0,0 +1,79 @@
+import json
+
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Converts everything the fast encoders cannot handle (e.g. dates for msgpack, lazy translations)
+# like the JSONEncoder of the rest framework.
+_default = JSONEncoder().default
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    A JSON renderer using orjson if it is installed, the output matches the JSONRenderer.
+    Without orjson (or if an indentation is requested with the browsable API) the JSONRenderer is used.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    Renders the data as MessagePack (requires msgpack).
+    Dates are encoded as ISO 8601 strings, like in the JSON representation.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(parsers.BaseParser):
+    """
+    Parses MessagePack request bodies (requires msgpack).
+    """
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """
+    This renderer is used for content negotiation of the event streams.
+    The events are written by the streaming response itself, this only renders errors.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return ('event: error\ndata: %s\n\n' % json.dumps(data)).encode(self.charset)
@@ -1,16 +1,59 @@
-from django.contrib.auth.models import Group, Permission, User
+import codecs
+import json
+
+from django.contrib.auth.models import Group, User
 from django.shortcuts import get_object_or_404
-from guardian.shortcuts import (assign_perm, get_groups_with_perms,
-                                get_objects_for_group, get_objects_for_user)
+from guardian.shortcuts import (get_groups_with_perms, get_objects_for_group,
+                                get_objects_for_user)
 from rest_framework import serializers
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.utils import html
+from rest_framework.validators import UniqueValidator
 from rest_framework_guardian.serializers import \
     ObjectPermissionsAssignmentMixin
 
-from . import models
+from . import batch, closing, duplicates, models, onboarding, provisioning
+
+
+def check_duplicates(serializer, booking):
+    """
+    Rejects exact duplicates of a new booking (unless the allow_duplicates parameter is set)
+    and remembers the near duplicates on the serializer (possibleDuplicates).
+    Changes of existing bookings are not checked, they may already be (allowed) duplicates.
+    """
+    if serializer.instance is not None:
+        return
+    exact, near = duplicates.find(booking)
+    serializer.possibleDuplicates = near
+    request = serializer.context['request']
+    if exact and request.query_params.get('allow_duplicates', '').lower() not in ('1', 'true', 'yes'):
+        raise serializers.ValidationError({'duplicates': exact})
+
+
+class BulkCompanySerializer(serializers.ListSerializer):
+    """
+    Creates all companies at once, see provisioning.create_companies.
+    """
+
+    def validate(self, data):
+        names = [entry['name'] for entry in data]
+        if len(names) != len(set(names)):
+            raise serializers.ValidationError("Company names must be unique")
+        if models.Company.objects.filter(name__in=names).exists():
+            raise serializers.ValidationError("Companies with these names already exist: %s" % ", ".join(
+                models.Company.objects.filter(name__in=names).values_list("name", flat=True)))
+        existing = Group.objects.filter(
+            name__in=[groupName for name in names for groupName in provisioning.group_names(name)])
+        if existing.exists():
+            raise serializers.ValidationError(
+                "Groups for these company names already exist: %s" % ", ".join(existing.values_list("name", flat=True)))
+        return data
+
+    def create(self, validated_data):
+        return provisioning.create_companies(validated_data, self.context['request'].user)
 
 
-class CompanySerializer(serializers.ModelSerializer, ObjectPermissionsAssignmentMixin):
+class CompanySerializer(serializers.ModelSerializer):
     """
     The serializer for the company model.
     """
@@ -19,21 +62,33 @@ class CompanySerializer(serializers.ModelSerializer, ObjectPermissionsAssignment
     class Meta:
         model = models.Company
         fields = ['name', 'description', 'groups', 'id']
+        list_serializer_class = BulkCompanySerializer
+
+    def get_fields(self):
+        """
+        In bulk creation the uniqueness of all names is checked at once by the BulkCompanySerializer.
+        """
+        fields = super().get_fields()
+        if self.parent is not None:
+            fields['name'].validators = [validator for validator in fields['name'].validators
+                                         if not isinstance(validator, UniqueValidator)]
+        return fields
+
+    def validate_name(self, value):
+        """
+        The groups of the company are named after it, so they must not exist yet
+        (checked for all companies at once in bulk creation).
+        """
+        if self.instance is None and self.parent is None and Group.objects.filter(name__in=provisioning.group_names(value)).exists():
+            raise serializers.ValidationError("A group for this company name already exists")
+        return value
 
     def create(self, validated_data):
         """
         This ensures that the groups for the company (admins and accountants) are created
-        and assignes the rights accordingly.
-        """
-        admins = Group.objects.create(
-            name=validated_data['name'] + ' Admins')
-        accountants = Group.objects.create(
-            name=validated_data['name'] + ' Accountants')
-        validated_data['accountants'] = accountants
-        validated_data['admins'] = admins
-        company = super(CompanySerializer, self).create(validated_data)
-        company.save()
-        return company
+        and assignes the rights accordingly (in one transaction, see provisioning.create_companies).
+        """
+        return provisioning.create_companies([validated_data], self.context['request'].user)[0]
 
     def get_groups(self, obj):
         """
@@ -42,27 +97,6 @@ class CompanySerializer(serializers.ModelSerializer, ObjectPermissionsAssignment
         groupsForCompany = get_groups_with_perms(obj)
         return [x.id for x in groupsForCompany]
 
-    def get_permissions_map(self, created):
-        """
-        This function is called by the permission assignment mixin.
-        The returned permissions are then assigned on the object.
-        """
-        current_user = self.context['request'].user
-        company = get_object_or_404(models.Company, pk=self.data['id'])
-        admins = company.admins
-        accountants = company.accountants
-        current_user.groups.add(admins)
-        current_user.groups.add(accountants)
-        assign_perm("change_group", admins, admins)
-        assign_perm("change_group", admins, accountants)
-        assign_perm("delete_group", admins, admins)
-        assign_perm("delete_group", admins, accountants)
-        return {
-            'view_company': [admins, accountants],
-            'change_company': [admins],
-            'delete_company': [admins]
-        }
-
 
 class SaleSerializer(serializers.ModelSerializer, ObjectPermissionsAssignmentMixin):
     """
@@ -73,7 +107,8 @@ class SaleSerializer(serializers.ModelSerializer, ObjectPermissionsAssignmentMix
 
     class Meta:
         model = models.Sale
-        fields = '__all__'
+        # the normalized key of the duplicate detection is internal
+        exclude = ['customerKey']
 
     def get_gross(self, obj):
         """
@@ -98,6 +133,13 @@ class SaleSerializer(serializers.ModelSerializer, ObjectPermissionsAssignmentMix
         if not self.context['request'].user.has_perm("view_company", company) or not all(
                 self.context['request'].user.has_perm("view_media", media) for media in invoice):
             raise PermissionDenied()
+        if self.instance is not None:
+            closing.ensure_open(self.instance.company,
+                                self.instance.cashflowdate)
+        closing.ensure_open(company, data.get("cashflowdate"))
+        check_duplicates(self, models.Sale(
+            pk=getattr(self.instance, 'pk', None), company=company, customer=data['customer'],
+            net=data['net'], invDate=data['invDate']))
         return data
 
     def get_permissions_map(self, created):
@@ -123,7 +165,8 @@ class PurchaseSerializer(serializers.ModelSerializer, ObjectPermissionsAssignmen
 
     class Meta:
         model = models.Purchase
-        fields = '__all__'
+        # the normalized keys of the duplicate detection are internal
+        exclude = ['billerKey', 'invNoKey']
 
     def get_gross(self, obj):
         """
@@ -142,6 +185,13 @@ class PurchaseSerializer(serializers.ModelSerializer, ObjectPermissionsAssignmen
         if not self.context['request'].user.has_perm("view_company", company) or not all(
                 self.context['request'].user.has_perm("view_media", media) for media in invoice):
             raise PermissionDenied()
+        if self.instance is not None:
+            closing.ensure_open(self.instance.company,
+                                self.instance.cashflowdate)
+        closing.ensure_open(company, data.get("cashflowdate"))
+        check_duplicates(self, models.Purchase(
+            pk=getattr(self.instance, 'pk', None), company=company, biller=data['biller'],
+            invNo=data['invNo'], net=data['net'], invDate=data['invDate']))
         return data
 
     def get_permissions_map(self, created):
@@ -159,6 +209,56 @@ class PurchaseSerializer(serializers.ModelSerializer, ObjectPermissionsAssignmen
         }
 
 
+class ArchivedSaleSerializer(serializers.ModelSerializer):
+    """
+    The read only serializer for the archived sales.
+    The representation matches the one of the SaleSerializer.
+    """
+    gross = serializers.SerializerMethodField()
+    invNo = serializers.SerializerMethodField()
+    invoice = serializers.SerializerMethodField()
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ArchivedSale
+        exclude = ['archived_at']
+
+    def get_gross(self, obj):
+        return obj.net * (1 + obj.vat)
+
+    def get_invNo(self, obj):
+        return str(obj.invDate.year) + str(obj.id)
+
+    def get_invoice(self, obj):
+        return json.loads(obj.invoice)
+
+    def get_archived(self, obj):
+        return True
+
+
+class ArchivedPurchaseSerializer(serializers.ModelSerializer):
+    """
+    The read only serializer for the archived purchases.
+    The representation matches the one of the PurchaseSerializer.
+    """
+    gross = serializers.SerializerMethodField()
+    invoice = serializers.SerializerMethodField()
+    archived = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.ArchivedPurchase
+        exclude = ['archived_at']
+
+    def get_gross(self, obj):
+        return obj.net * (1 + obj.vat)
+
+    def get_invoice(self, obj):
+        return json.loads(obj.invoice)
+
+    def get_archived(self, obj):
+        return True
+
+
 class VatReportSerializer(serializers.Serializer):
     """
     This is a serializer used for calculating the vat within a certain time
@@ -170,6 +270,123 @@ class VatReportSerializer(serializers.Serializer):
     vatOut = serializers.FloatField()
 
 
+class CashflowSerializer(serializers.Serializer):
+    """
+    This is a serializer used for the cashflow timeline of a company.
+    Like the VatReportSerializer, it does not belong to a model.
+    Every entry represents one bucket (day or week) with the running balance.
+    """
+    date = serializers.DateField()
+    inflow = serializers.FloatField()
+    outflow = serializers.FloatField()
+    net = serializers.FloatField()
+    balance = serializers.FloatField()
+
+
+class ClosedPeriodTotalSerializer(serializers.ModelSerializer):
+    """
+    The serializer for the totals of a closed period.
+    """
+
+    class Meta:
+        model = models.ClosedPeriodTotal
+        fields = ['kind', 'bookingType', 'vat', 'net', 'gross']
+
+
+class ClosedPeriodSerializer(serializers.ModelSerializer):
+    """
+    The serializer for the closed period model.
+    Only the company and the range are given, the totals are calculated when the period is closed.
+    """
+    totals = ClosedPeriodTotalSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = models.ClosedPeriod
+        fields = '__all__'
+        read_only_fields = ['vatIn', 'vatOut', 'salesNet', 'salesGross',
+                            'purchasesNet', 'purchasesGross', 'closed_at']
+
+    def validate(self, data):
+        """
+        Only the admins of a company can close a period.
+        """
+        if not self.context['request'].user.has_perm("change_company", data['company']):
+            raise PermissionDenied()
+        if data['start'] > data['end']:
+            raise serializers.ValidationError("start must not be after end")
+        return data
+
+    def create(self, validated_data):
+        return closing.close_period(validated_data['company'], validated_data['start'], validated_data['end'])
+
+
+class BankImportSerializer(serializers.Serializer):
+    """
+    This is a serializer for the file and the options of a bank statement import (see bankimport.py).
+    """
+    file = serializers.FileField()
+    company = serializers.IntegerField()
+    apply = serializers.BooleanField(default=True)
+    dateColumn = serializers.CharField(default='date')
+    amountColumn = serializers.CharField(default='amount')
+    referenceColumn = serializers.CharField(default='reference')
+    delimiter = serializers.CharField(
+        required=False, allow_blank=True, max_length=1, trim_whitespace=False)
+    decimal = serializers.ChoiceField(choices=['.', ','], default='.')
+    dateFormat = serializers.CharField(required=False, allow_blank=True)
+    encoding = serializers.CharField(default='utf-8-sig')
+    window = serializers.IntegerField(default=60, min_value=0, max_value=3650)
+    minConfidence = serializers.FloatField(
+        default=0.5, min_value=0, max_value=1)
+
+    def validate_encoding(self, value):
+        try:
+            codecs.lookup(value)
+        except LookupError:
+            raise serializers.ValidationError("Unknown encoding")
+        return value
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    """
+    This is a serializer for a single operation of a batch request.
+    """
+    method = serializers.ChoiceField(
+        choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+    files = serializers.DictField(
+        child=serializers.CharField(), required=False)
+
+
+class BatchOperationsField(serializers.ListField):
+    """
+    The operations of a batch request, as list or (in multipart requests) as JSON string.
+    """
+    child = BatchOperationSerializer()
+
+    def get_value(self, dictionary):
+        if html.is_html_input(dictionary):
+            return dictionary.get(self.field_name, serializers.empty)
+        return super().get_value(dictionary)
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                raise serializers.ValidationError("Invalid JSON")
+        return super().to_internal_value(data)
+
+
+class BatchSerializer(serializers.Serializer):
+    """
+    This is a serializer for a batch request (see batch.py).
+    """
+    operations = BatchOperationsField(
+        allow_empty=False, max_length=batch.MAX_OPERATIONS)
+
+
 class UserSerializer(serializers.ModelSerializer):
     """
     The serializer for the user model.
@@ -226,40 +443,10 @@ class UserSerializer(serializers.ModelSerializer):
         Change permission is also given to the user himself.
         In addition, global permissions are assigned since they are needed in some special cases.
         Per definition, a accountant (i.e. a user that is created by an admin) cannot create companies.
-        For simplification, the ObjectPermissionsAssignmentMixin can be used.
         Minor security "feature" :) : accountants can create other accountants.
+        The user and all permissions are created in bulk, see onboarding.create_users.
         """
-        user = super(UserSerializer, self).create(validated_data)
-        for i in user.groups.all():
-            if i.accountants.exists():
-                company = get_object_or_404(
-                    models.Company, pk=i.accountants.all().first().id)
-                assign_perm("change_user", company.admins, user)
-                assign_perm("view_user", company.admins, user)
-                assign_perm("delete_user", company.admins, user)
-        assign_perm("change_user", user, user)
-        assign_perm("view_user", user, user)
-        assign_perm("delete_user", user, user)
-
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add sale'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete sale'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add purchase'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can change sale'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can change purchase'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete purchase'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add media'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete media'))
-        user.set_password(validated_data['password'])
-        user.save()
-        return user
+        return onboarding.create_users([validated_data], onboarding.ACCOUNTANT_PERMISSIONS)[0]
 
     def update(self, instance, validated_data):
         """
@@ -293,40 +480,82 @@ class RegisterUserSerializer(serializers.ModelSerializer):
         Change permission is also given to the user himself.
         In addition, global permissions are assigned since they are needed in some special cases.
         This user is able to create companies.
-        For simplification, the ObjectPermissionsAssignmentMixin can be used.
-        """
-        user = super(RegisterUserSerializer, self).create(validated_data)
-        assign_perm("change_user", user, user)
-        assign_perm("view_user", user, user)
-        assign_perm("delete_user", user, user)
-        user.set_password(validated_data['password'])
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add company'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add sale'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add purchase'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can add media'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete company'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete sale'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete purchase'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can delete media'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can change company'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can change sale'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can change purchase'))
-        user.user_permissions.add(
-            Permission.objects.get(name='Can change media'))
+        The user and all permissions are created in bulk, see onboarding.create_users.
+        """
+        return onboarding.create_users([validated_data], onboarding.REGISTERED_PERMISSIONS)[0]
 
-        user.save()
-        return user
+
+class GroupIdField(serializers.PrimaryKeyRelatedField):
+    """
+    A group id which is not looked up per user, the BulkUserInviteSerializer resolves
+    the groups of all users at once.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not str(data).isdigit():
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        return int(data)
+
+
+class BulkUserInviteSerializer(serializers.ListSerializer):
+    """
+    Creates all invited users at once, see onboarding.create_users.
+    The usernames and the groups of all users are checked with one query each.
+    """
+
+    def validate(self, data):
+        usernames = [entry['username'] for entry in data]
+        if len(usernames) != len(set(usernames)):
+            raise serializers.ValidationError("Usernames must be unique")
+        taken = list(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        if taken:
+            raise serializers.ValidationError({'username': ["A user with that username already exists: %s" % ', '.join(taken)]})
+        groups = Group.objects.in_bulk({pk for entry in data for pk in entry.get('groups', [])})
+        for entry in data:
+            missing = [pk for pk in entry.get('groups', []) if pk not in groups]
+            if missing:
+                raise serializers.ValidationError({'groups': ['Invalid pk "%s" - object does not exist.' % missing[0]]})
+            entry['groups'] = [groups[pk] for pk in entry.get('groups', [])]
+        return data
+
+    def create(self, validated_data):
+        return onboarding.create_users(validated_data, onboarding.ACCOUNTANT_PERMISSIONS)
+
+
+class UserInviteSerializer(serializers.ModelSerializer):
+    """
+    The serializer for the bulk invitation of users by an admin.
+    The groups the inviting user may assign (allowedGroups) are passed in the context,
+    so they are only calculated once for all invited users.
+    """
+    password = serializers.CharField(write_only=True, required=False)
+    groups = GroupIdField(many=True, queryset=Group.objects.all(), required=False)
+
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'email', 'password',
+                  'first_name', 'last_name', 'groups']
+        list_serializer_class = BulkUserInviteSerializer
+
+    def get_fields(self):
+        """
+        In bulk creation the uniqueness of all usernames is checked at once by the BulkUserInviteSerializer.
+        """
+        fields = super().get_fields()
+        if self.parent is not None:
+            fields['username'].validators = [validator for validator in fields['username'].validators
+                                             if not isinstance(validator, UniqueValidator)]
+        return fields
+
+    def validate(self, data):
+        """
+        Like in the UserSerializer, the user can only assign groups he can change or
+        groups he is a member of (both are sets of group ids).
+        """
+        groups = set(data.get('groups', []))
+        if any(groups <= allowed for allowed in self.context['allowedGroups']):
+            return data
+        raise PermissionDenied()
 
 
 class GroupSerializer(serializers.ModelSerializer):
@@ -1,3 +1,214 @@
-from django.test import TestCase
+import datetime
+import json
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from . import models, throttling
+
+
+def register(username):
+    """
+    Registers a user through the API and returns a client authenticated as this user.
+    """
+    client = APIClient()
+    response = client.post('/users/', {'username': username, 'password': 'pw'}, format='json')
+    assert response.status_code == 201, response.content
+    client.force_authenticate(User.objects.get(username=username))
+    return client
+
+
+def sale(companyId, **fields):
+    return dict({'company': companyId, 'bookingType': 'x', 'invDate': '2020-01-01', 'customer': 'c',
+                 'project': 'p', 'vat': 0.2, 'net': 10, 'cashflowdate': None, 'invoice': []}, **fields)
+
+
+class BatchTests(APITestCase):
+
+    def setUp(self):
+        self.client = register('alice')
+        self.company = self.client.post('/companies/', {'name': 'ACME'}, format='json').data['id']
+
+    def test_references(self):
+        response = self.client.post('/batch/', [
+            {'method': 'POST', 'path': '/sales/', 'body': sale(self.company, customer='first')},
+            {'method': 'PUT', 'path': '/sales/$0.id/', 'body': sale(self.company, customer='first', notes='$0.customer')},
+            {'method': 'GET', 'path': '/sales/$0.id/?fields=id,notes'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        saleId = response.data[0]['body']['id']
+        self.assertEqual([result['status'] for result in response.data], [201, 200, 200])
+        self.assertEqual(response.data[2]['body'], {'id': saleId, 'notes': 'first'})
+
+    def test_reference_before_execution(self):
+        response = self.client.post('/batch/', {'operations': [
+            {'method': 'GET', 'path': '/sales/$1.id/'}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rollback(self):
+        response = self.client.post('/batch/', [
+            {'method': 'POST', 'path': '/sales/', 'body': sale(self.company)},
+            {'method': 'POST', 'path': '/sales/', 'body': {'company': self.company}},
+            {'method': 'POST', 'path': '/sales/', 'body': sale(self.company, customer='skipped')},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.data], [201, 400])
+        self.assertFalse(models.Sale.objects.exists())
+
+    def test_nested_batch(self):
+        response = self.client.post('/batch/', [{'method': 'POST', 'path': '/batch/', 'body': []}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_operations(self):
+        for data, format in [({'operations': 'notjson'}, 'json'), ({'operations': 'notjson'}, 'multipart'),
+                             ({'operations': [{}]}, 'json'), ([{'method': 'GET'}] * 51, 'json')]:
+            self.assertEqual(self.client.post('/batch/', data, format=format).status_code, 400)
+
+
+class BatchMediaTests(APITransactionTestCase):
+    """
+    The media file is written on commit, so these tests need real transactions.
+    """
+
+    def setUp(self):
+        self.mediaRoot = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.mediaRoot)
+        settings = override_settings(MEDIA_ROOT=self.mediaRoot)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client = register('alice')
+        self.company = self.client.post('/companies/', {'name': 'ACME'}, format='json').data['id']
+
+    def upload(self, *operations):
+        media = {'method': 'POST', 'path': '/media/', 'body': {'company': self.company}, 'files': {'file': 'upload'}}
+        return self.client.post('/batch/', {
+            'operations': json.dumps([media] + list(operations)),
+            'upload': SimpleUploadedFile('invoice.pdf', b'pdf', content_type='application/pdf'),
+        }, format='multipart')
+
+    def test_media_with_booking(self):
+        response = self.upload({'method': 'POST', 'path': '/sales/', 'body': sale(self.company, invoice=['$0.id'])})
+        self.assertEqual(response.status_code, 200)
+        mediaId = response.data[0]['body']['id']
+        self.assertEqual(response.data[1]['body']['invoice'], [mediaId])
+        with default_storage.open('media/%d' % mediaId) as file:
+            self.assertEqual(file.read(), b'pdf')
+
+    def test_media_not_written_on_rollback(self):
+        response = self.upload({'method': 'POST', 'path': '/sales/', 'body': {'company': self.company}})
+        self.assertEqual(response.status_code, 400)
+        mediaId = response.data[0]['body']['id']
+        self.assertFalse(models.Media.objects.exists())
+        self.assertFalse(default_storage.exists('media/%d' % mediaId))
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates))
+
+
+class ThrottleTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.clock = 1000.0
+        buckets = throttling.LocalBuckets()
+        buckets.now = lambda: self.clock
+        patcher = mock.patch.object(throttling, '_local', buckets)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = register('alice')
+        self.company = self.client.post('/companies/', {'name': 'ACME'}, format='json').data['id']
+
+    def test_refill_and_retry_after(self):
+        with throttle_rates(user='2/min'):
+            for remaining in ('1', '0'):
+                response = self.client.get('/sales/')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['X-RateLimit-Remaining'], remaining)
+            response = self.client.get('/sales/')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '30')
+            self.clock += 29
+            self.assertEqual(self.client.get('/sales/').status_code, 429)
+            self.clock += 1
+            self.assertEqual(self.client.get('/sales/').status_code, 200)
+
+    def test_expensive_budget(self):
+        with throttle_rates(user='100/min', user_expensive='1/min'):
+            self.assertEqual(self.client.get('/sales/duplicates/', {'company': self.company}).status_code, 200)
+            self.assertEqual(self.client.get('/sales/duplicates/', {'company': self.company}).status_code, 429)
+            self.assertEqual(self.client.get('/sales/').status_code, 200)
+
+    def test_company_budget(self):
+        other = register('bob')
+        with throttle_rates(company='1/min'):
+            # the company of another tenant is not used as key
+            for _ in range(3):
+                self.assertEqual(other.get('/sales/', {'company': self.company}).status_code, 200)
+            self.assertEqual(self.client.get('/sales/', {'company': self.company}).status_code, 200)
+            self.assertEqual(self.client.get('/sales/', {'company': self.company}).status_code, 429)
+            self.assertEqual(self.client.get('/sales/').status_code, 200)
+
+    def test_without_rates(self):
+        with throttle_rates():
+            for _ in range(3):
+                response = self.client.get('/sales/')
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.has_header('X-RateLimit-Remaining'))
+
+
+class DeltaSyncTests(APITestCase):
+
+    def setUp(self):
+        self.client = register('alice')
+        self.company = self.client.post('/companies/', {'name': 'ACME'}, format='json').data['id']
+
+    def sync(self, token):
+        response = self.client.get('/sales/', {'since': token})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_token_lags_behind(self):
+        margin = datetime.timedelta(seconds=settings.ACCOUNTX_SYNC_MARGIN)
+        before = timezone.now()
+        token = parse_datetime(self.client.get('/sales/')['X-Sync-Token'])
+        self.assertTrue(before - margin <= token <= timezone.now() - margin)
+
+    def test_changed_and_deleted(self):
+        token = self.client.get('/sales/')['X-Sync-Token']
+        kept = self.client.post('/sales/', sale(self.company, customer='kept'), format='json').data['id']
+        removed = self.client.post('/sales/', sale(self.company, customer='removed'), format='json').data['id']
+        self.assertEqual(self.client.delete('/sales/%d/' % removed).status_code, 204)
+        response = self.sync(token)
+        self.assertEqual([entry['id'] for entry in response.data['changed']], [kept])
+        self.assertEqual(response.data['deleted'], [removed])
+        self.assertEqual(response['X-Sync-Token'], response.data['token'])
+
+    def test_late_commit_is_not_skipped(self):
+        token = self.client.get('/sales/')['X-Sync-Token']
+        saleId = self.client.post('/sales/', sale(self.company), format='json').data['id']
+        # written by a transaction which started before the token was handed out and committed after it
+        models.Sale.objects.filter(pk=saleId).update(updated_at=timezone.now() - datetime.timedelta(seconds=30))
+        self.assertEqual([entry['id'] for entry in self.sync(token).data['changed']], [saleId])
+
+    def test_other_companies_are_not_synced(self):
+        token = self.client.get('/sales/')['X-Sync-Token']
+        saleId = self.client.post('/sales/', sale(self.company), format='json').data['id']
+        self.client.delete('/sales/%d/' % saleId)
+        other = register('bob')
+        response = other.get('/sales/', {'since': token})
+        self.assertEqual((response.data['changed'], response.data['deleted']), ([], []))
+
+    def test_invalid_token(self):
+        for token in ('2020-02-31T00:00:00Z', 'x'):
+            self.assertEqual(self.client.get('/sales/', {'since': token}).status_code, 400)
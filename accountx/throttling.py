@@ -0,0 +1,208 @@
+"""
+Throttling of the API by user and by company.
+Every user and every company has a token bucket for cheap requests (lists, CRUD) and one for
+expensive requests (reports, imports, batches, event streams; see expensive_actions of the views).
+A bucket holds up to <num> tokens and refills at <num>/<period>, so short bursts are allowed
+while the long term rate is limited. The rates are the DEFAULT_THROTTLE_RATES of the scopes
+user, company, user_expensive and company_expensive.
+The buckets are kept in process by default. With ACCOUNTX_THROTTLE_CACHE set to a cache alias
+(e.g. redis or memcached) they are shared between all workers.
+Scopes without a rate are skipped before anything else is done. The company of a request is
+resolved from the cache (companies the user can view, company of an object), so a throttled
+request usually needs no queries.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from guardian.shortcuts import get_objects_for_user
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+from . import models
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+MAX_LOCAL_BUCKETS = 10000
+
+# Seconds the companies of a user and the company of an object are cached for the throttling.
+COMPANIES_TIMEOUT = 60
+
+
+class LocalBuckets:
+    """
+    The buckets of this process. A bucket is a (tokens, timestamp) tuple which is replaced
+    as a whole; concurrent requests can at most take the same token twice.
+    Like in the cache, buckets which are not used for a whole period expire, and at most
+    MAX_LOCAL_BUCKETS are kept (the least recently used are dropped).
+    """
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def now(self):
+        return time.monotonic()
+
+    def get(self, key):
+        entry = self._buckets.get(key)
+        if entry is None or entry[1] < self.now():
+            return None
+        return entry[0]
+
+    def set(self, key, bucket, duration):
+        with self._lock:
+            self._buckets[key] = (bucket, self.now() + duration)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > MAX_LOCAL_BUCKETS:
+                self._buckets.popitem(last=False)
+
+
+class CacheBuckets(LocalBuckets):
+    """
+    The buckets in a shared cache. Buckets which are not used for a whole period are full
+    again and expire.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def now(self):
+        return time.time()
+
+    def get(self, key):
+        return self.cache.get('throttle:' + key)
+
+    def set(self, key, bucket, duration):
+        self.cache.set('throttle:' + key, bucket, duration)
+
+
+_local = LocalBuckets()
+
+
+def buckets():
+    alias = getattr(settings, 'ACCOUNTX_THROTTLE_CACHE', None)
+    return CacheBuckets(alias) if alias else _local
+
+
+def _cache():
+    return caches[getattr(settings, 'ACCOUNTX_THROTTLE_CACHE', None) or 'default']
+
+
+def is_expensive(request, view):
+    action = getattr(view, 'action', None) or request.method.lower()
+    return action in getattr(view, 'expensive_actions', ())
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Takes a token from the bucket of the scope (scope or scope_expensive) and the ident of the request.
+    The usage of the most used bucket is stored on the request for the RateLimitHeadersMiddleware.
+    """
+    scope = None
+
+    def get_ident_key(self, request, view):
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def allow_request(self, request, view):
+        self.waitTime = None
+        scope = self.scope + '_expensive' if is_expensive(request, view) else self.scope
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+        num, duration = SimpleRateThrottle.parse_rate(self, rate)
+        refill = num / duration
+        store = buckets()
+        key = '%s:%s' % (scope, ident)
+        now = store.now()
+        tokens, stamp = store.get(key) or (num, now)
+        tokens = min(num, tokens + (now - stamp) * refill)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        else:
+            self.waitTime = (1 - tokens) / refill
+        store.set(key, (tokens, now), duration)
+        usage = {'scope': scope, 'limit': num, 'remaining': int(tokens),
+                 'reset': int((num - tokens) / refill + 0.999)}
+        current = getattr(request._request, 'throttle_usage', None)
+        if current is None or usage['remaining'] / num < current['remaining'] / current['limit']:
+            request._request.throttle_usage = usage
+        return allowed
+
+    def wait(self):
+        return self.waitTime
+
+
+class UserThrottle(TokenBucketThrottle):
+    """
+    Throttles by user (anonymous requests by ip address).
+    """
+    scope = 'user'
+
+    def get_ident_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return 'anon-' + self.get_ident(request)
+
+
+def viewable_companies(user):
+    """
+    Returns the ids of the companies the user can view (cached for COMPANIES_TIMEOUT seconds).
+    """
+    key = 'throttle-companies:%s' % user.pk
+    companies = _cache().get(key)
+    if companies is None:
+        companies = set(get_objects_for_user(user, 'accountx.view_company', klass=models.Company)
+                        .values_list('pk', flat=True))
+        _cache().set(key, companies, COMPANIES_TIMEOUT)
+    return companies
+
+
+def _object_company(model, pk):
+    key = 'throttle-company:%s:%s' % (model._meta.label_lower, pk)
+    companyId = _cache().get(key)
+    if companyId is None:
+        companyId = model.objects.filter(pk=pk).values_list('company_id', flat=True).first()
+        if companyId is not None:
+            _cache().set(key, companyId, COMPANIES_TIMEOUT)
+    return companyId
+
+
+def company_id(request, view):
+    """
+    Returns the id of the company of the request: the cid or company parameter,
+    the company field of the body or the company of the requested object.
+    Only companies the user can view are returned, so nobody can use up the budget of another company.
+    """
+    if not (request.user and request.user.is_authenticated):
+        return None
+    cid = request.query_params.get('cid') or request.query_params.get('company')
+    if cid is None and request.method not in SAFE_METHODS and hasattr(request.data, 'get'):
+        cid = request.data.get('company')
+    pk = view.kwargs.get('pk')
+    queryset = getattr(view, 'queryset', None)
+    if cid is None and str(pk).isdigit() and queryset is not None:
+        if queryset.model is models.Company:
+            cid = pk
+        elif any(field.name == 'company' for field in queryset.model._meta.fields):
+            cid = _object_company(queryset.model, pk)
+    if not str(cid).isdigit() or int(cid) not in viewable_companies(request.user):
+        return None
+    return int(cid)
+
+
+class CompanyThrottle(TokenBucketThrottle):
+    """
+    Throttles by company, so a single tenant cannot slow down all the others.
+    Requests without a company (or for a company the user cannot view) are not throttled by it.
+    """
+    scope = 'company'
+
+    def get_ident_key(self, request, view):
+        return company_id(request, view)
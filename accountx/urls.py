@@ -9,8 +9,12 @@ router.register(r'sales', views.SaleViewSet)
 router.register(r'purchases', views.PurchaseViewSet)
 router.register(r'users', views.UserViewSet, basename="users")
 router.register(r'vatReport', views.VatReportViewset, basename="vatreport")
+router.register(r'cashflow', views.CashflowViewset, basename="cashflow")
+router.register(r'closedPeriods', views.ClosedPeriodViewSet, basename="closedperiods")
+router.register(r'bankImport', views.BankImportViewset, basename="bankimport")
 router.register(r'groups', views.GroupViewSet, basename="groups")
 router.register(r'media', views.MediaViewSet, basename="media")
 urlpatterns = [
     path('', include(router.urls)),
+    path('batch/', views.BatchView.as_view(), name='batch'),
 ]
@@ -1,19 +1,32 @@
+import csv
+import datetime
+from types import SimpleNamespace
+
+from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django_filters import rest_framework as filters
+from guardian.models import GroupObjectPermission
 from guardian.shortcuts import (get_groups_with_perms, get_objects_for_user,
                                 get_users_with_perms)
-from rest_framework import viewsets
-from rest_framework.exceptions import APIException, PermissionDenied
+from rest_framework import mixins, pagination, views, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, PermissionDenied, ValidationError
 from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_guardian import filters as guardianFilters
 
-from . import models, serializers
+from . import (archive, bankimport, batch, cashflow, closing, directory, duplicates, events,
+               models, renderers, serializers)
 
 
 class SaleFilter(filters.FilterSet):
@@ -36,9 +49,9 @@ class UserFilter(filters.FilterSet):
 
     def filter_companies(self, queryset, name, value):
         company = get_objects_for_user(
-            self.request.user, "view_company", klass=models.Company).filter(pk=value)
-        if company.exists():
-            return get_users_with_perms(company.first())
+            self.request.user, "view_company", klass=models.Company).filter(pk=value).first()
+        if company is not None:
+            return get_users_with_perms(company)
         else:
             return User.objects.none()
 
@@ -55,9 +68,9 @@ class GroupFilter(filters.FilterSet):
 
     def filter_companies(self, queryset, name, value):
         company = get_objects_for_user(
-            self.request.user, "view_company", klass=models.Company).filter(pk=value)
-        if company.exists():
-            return get_groups_with_perms(company.first())
+            self.request.user, "view_company", klass=models.Company).filter(pk=value).first()
+        if company is not None:
+            return get_groups_with_perms(company)
         else:
             return Group.objects.none()
 
@@ -78,22 +91,321 @@ class PurchaseFilter(filters.FilterSet):
         fields = ('company', 'cashflowdate', 'invDate')
 
 
-class CompanyViewSet(viewsets.ModelViewSet):
+class SparseFieldsMixin:
+    """
+    Adds sparse fieldsets to the viewset: with the fields parameter (comma separated names)
+    only these fields are returned.
+    Read only lists are built from values() instead of model instances and the serializer.
+    Fields the fast path cannot build from the columns (SerializerMethodFields) are listed in
+    fast_fields with the columns they need, the serializer method is then called with the row.
+    A method fast_<field>(rows) can be used to fill a field for all rows at once instead.
+    """
+    fast_fields = {}
+
+    def requested_fields(self):
+        fields = self.request.query_params.get("fields")
+        if self.request.method != "GET" or not fields:
+            return None
+        return [name.strip() for name in fields.split(",") if name.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        requested = self.requested_fields()
+        if requested is not None:
+            fields = getattr(serializer, "child", serializer).fields
+            for name in list(fields):
+                if name not in requested:
+                    fields.pop(name)
+        return serializer
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        names = list(serializer.fields)
+        model = self.queryset.model
+        columns = {field.name for field in model._meta.concrete_fields}
+        manyToMany = {field.name: field for field in model._meta.many_to_many}
+        if self.paginator is not None or not all(
+                name in columns or name in manyToMany or name in self.fast_fields or
+                hasattr(self, "fast_" + name) for name in names):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        values = {"pk"} | {name for name in names if name in columns}
+        for name in names:
+            values.update(self.fast_fields.get(name, []))
+        rows = list(queryset.prefetch_related(None).values(*values))
+        for name in names:
+            if name in manyToMany:
+                self._fast_many_to_many(rows, queryset, manyToMany[name])
+            elif hasattr(self, "fast_" + name):
+                getattr(self, "fast_" + name)(rows)
+            elif name in self.fast_fields:
+                method = getattr(serializer, "get_" + name)
+                for row in rows:
+                    row[name] = method(SimpleNamespace(**dict(row, id=row["pk"])))
+        return Response([{name: row[name] for name in names} for row in rows])
+
+    def _fast_many_to_many(self, rows, queryset, field):
+        """
+        Fills the ids of a many to many field for all rows with a single query.
+        """
+        source = field.m2m_field_name()
+        target = field.m2m_reverse_field_name()
+        related = {}
+        for sourceId, targetId in field.remote_field.through.objects.filter(
+                **{source + "__in": queryset.values("pk")}).values_list(source + "_id", target + "_id"):
+            related.setdefault(sourceId, []).append(targetId)
+        for row in rows:
+            row[field.name] = related.get(row["pk"], [])
+
+
+class DeltaSyncMixin:
+    """
+    Adds the delta sync to the list view of a viewset.
+    Every list response carries a sync token in the X-Sync-Token header. If this token is
+    passed as since parameter, only the objects changed since then and the ids of the
+    deleted objects are returned.
+    The token lags behind the time of the request (ACCOUNTX_SYNC_MARGIN seconds), so changes of
+    transactions which commit after the query are returned again by the next sync instead of
+    being skipped. Clients therefore receive some objects twice.
+    """
+
+    def list(self, request, *args, **kwargs):
+        margin = datetime.timedelta(seconds=getattr(settings, "ACCOUNTX_SYNC_MARGIN", 60))
+        token = (timezone.now() - margin).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        since = request.query_params.get("since")
+        if since is None:
+            response = super().list(request, *args, **kwargs)
+        else:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError(detail="Invalid sync token")
+            changed = self.filter_queryset(
+                self.get_queryset()).filter(updated_at__gt=since)
+            companies = get_objects_for_user(
+                request.user, "view_company", klass=models.Company)
+            deleted = models.Tombstone.objects.filter(
+                company__in=companies, model=self.queryset.model._meta.model_name, deleted_at__gt=since)
+            if request.query_params.get("company"):
+                deleted = deleted.filter(
+                    company=request.query_params.get("company"))
+            response = Response({
+                "token": token,
+                "changed": self.get_serializer(changed, many=True).data,
+                "deleted": list(deleted.values_list("object_id", flat=True))
+            })
+        response["X-Sync-Token"] = token
+        return response
+
+    def perform_destroy(self, instance):
+        """
+        Records the deletion, so it can be passed on in the delta sync.
+        """
+        with transaction.atomic():
+            models.Tombstone.objects.create(
+                company=instance.company, model=instance._meta.model_name, object_id=instance.pk)
+            super().perform_destroy(instance)
+
+
+def include_archived(request):
+    """
+    Returns whether the archived bookings are requested (include_archived parameter).
+    """
+    return request.query_params.get("include_archived", "").lower() in ("1", "true", "yes")
+
+
+class ArchiveMixin:
+    """
+    Adds the archived bookings to the list view, if include_archived is set.
+    The filters of the viewset are applied to the archived bookings as well.
+    """
+    archive_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if not include_archived(request) or "since" in request.query_params:
+            return response
+        companies = get_objects_for_user(
+            request.user, "view_company", klass=models.Company)
+        archived = archive.archived(self.queryset.model).filter(
+            company__in=list(companies.values_list("pk", flat=True)))
+        archived = self.filterset_class(
+            request.query_params, queryset=archived, request=request).qs
+        archived = self.archive_serializer_class(
+            archived, many=True, context=self.get_serializer_context()).data
+        requested = self.requested_fields()
+        if requested is not None:
+            archived = [{name: value for name, value in row.items() if name in requested}
+                        for row in archived]
+        response.data = list(response.data) + list(archived)
+        return response
+
+
+class DuplicateCheckMixin:
+    """
+    Adds the duplicate report and returns the ids of possible (near) duplicates of a new booking
+    in the X-Possible-Duplicates header. Exact duplicates are rejected by the serializer.
+    """
+    expensive_actions = ["duplicates"]
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.possibleDuplicates = getattr(serializer, "possibleDuplicates", [])
+
+    def create(self, request, *args, **kwargs):
+        try:
+            response = super().create(request, *args, **kwargs)
+        except ValidationError as exc:
+            # the ids of the exact duplicates are returned as numbers, like in the duplicate report
+            if isinstance(exc.detail, dict) and "duplicates" in exc.detail:
+                exc.detail["duplicates"] = [int(pk) for pk in exc.detail["duplicates"]]
+            raise
+        if getattr(self, "possibleDuplicates", None):
+            response["X-Possible-Duplicates"] = ",".join(
+                str(pk) for pk in self.possibleDuplicates)
+        return response
+
+    @action(detail=False)
+    def duplicates(self, request):
+        """
+        Lists the groups of exact and of near duplicates of a company.
+        The range for near duplicates (in days) can be set with the days parameter.
+        """
+        cid = request.query_params.get("company")
+        if cid is None:
+            raise APIException(detail="Url parameters missing")
+        company = get_object_or_404(models.Company, pk=cid)
+        if not request.user.has_perm("view_company", company):
+            raise PermissionDenied
+        window = request.query_params.get("days")
+        exact, near = duplicates.report(
+            self.queryset.model, company, int(window) if window and window.isdigit() else None)
+        return Response({"exact": exact, "near": near})
+
+
+class ChangeEventMixin:
+    """
+    Records every change made through the viewset for the event stream of the company.
+    """
+
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            super().perform_create(serializer)
+            events.record_change(serializer.instance, "create")
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            super().perform_update(serializer)
+            events.record_change(serializer.instance, "update")
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            events.record_change(instance, "delete")
+            super().perform_destroy(instance)
+
+
+class PeriodLockMixin:
+    """
+    Prevents the deletion of bookings within a closed period.
+    Changes are checked by the serializers.
+    """
+
+    def perform_destroy(self, instance):
+        closing.ensure_open(instance.company, instance.cashflowdate)
+        super().perform_destroy(instance)
+
+
+class MemberPagination(pagination.CursorPagination):
+    """
+    Cursor pagination of the member directory by user id.
+    """
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class CompanyViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """
     A viewset for the companies.
     """
     queryset = models.Company.objects.all()
     serializer_class = serializers.CompanySerializer
+    expensive_actions = ["events", "bulk"]
     filter_backends = [filters.DjangoFilterBackend,
                        guardianFilters.ObjectPermissionsFilter]
 
+    def fast_groups(self, rows):
+        """
+        The groups with any permission on the companies, like CompanySerializer.get_groups.
+        """
+        groups = {}
+        for objectPk, groupId in GroupObjectPermission.objects.filter(
+                content_type=ContentType.objects.get_for_model(models.Company),
+                object_pk__in=[str(row["pk"]) for row in rows]).values_list("object_pk", "group_id").distinct():
+            groups.setdefault(int(objectPk), []).append(groupId)
+        for row in rows:
+            row["groups"] = groups.get(row["pk"], [])
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Creates many companies at once (a list of companies is expected), e.g. for franchises.
+        The companies are created like with a single create, but in bulk and in one transaction.
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        companies = serializer.save()
+        # the groups with permissions on new companies are just their admins and accountants
+        return Response([{"name": company.name, "description": company.description,
+                          "groups": sorted([company.admins_id, company.accountants_id]), "id": company.pk}
+                         for company in companies], status=201)
+
+    @action(detail=True)
+    def members(self, request, pk=None):
+        """
+        The members of the company (users of the admins and accountants groups) with their role,
+        cursor paginated (cursor, page_size). The pages are cached until the memberships change.
+        """
+        company = self.get_object()
+        paginator = MemberPagination()
+        key = directory.cache_key(company.pk, request.query_params.get(paginator.cursor_query_param),
+                                  paginator.get_page_size(request))
+        data = cache.get(key)
+        if data is None:
+            page = paginator.paginate_queryset(directory.members(company), request, view=self)
+            data = paginator.get_paginated_response(page).data
+            cache.set(key, data, directory.timeout())
+        return Response(data)
+
+    @action(detail=True, renderer_classes=[renderers.EventStreamRenderer])
+    def events(self, request, pk=None):
+        """
+        A server-sent event stream of all changes on sales, purchases and media of the company.
+        Reconnecting clients continue after the id passed in the Last-Event-ID header.
+        """
+        company = self.get_object()
+        last_event_id = request.META.get("HTTP_LAST_EVENT_ID")
+        if last_event_id is not None and not last_event_id.isdigit():
+            raise APIException(detail="Invalid Last-Event-ID")
+        response = StreamingHttpResponse(
+            events.event_stream(company.pk, last_event_id and int(last_event_id)),
+            content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
 
-class SaleViewSet(viewsets.ModelViewSet):
+class SaleViewSet(DuplicateCheckMixin, ArchiveMixin, PeriodLockMixin, ChangeEventMixin, DeltaSyncMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     A viewset for the sales.
     """
-    queryset = models.Sale.objects.all()
+    queryset = models.Sale.objects.prefetch_related('invoice')
     serializer_class = serializers.SaleSerializer
+    fast_fields = {'gross': ['net', 'vat'], 'invNo': ['invDate']}
+    archive_serializer_class = serializers.ArchivedSaleSerializer
     filterset_class = SaleFilter
     filter_backends = [filters.DjangoFilterBackend,
                        guardianFilters.ObjectPermissionsFilter]
@@ -104,6 +416,7 @@ class VatReportViewset(viewsets.ViewSet):
     A viewset for the vat report.
     """
     permission_classes = [IsAuthenticated]
+    expensive_actions = ["list"]
     serializer_class = serializers.VatReportSerializer
 
     def list(self, request):
@@ -119,29 +432,112 @@ class VatReportViewset(viewsets.ViewSet):
         company = get_object_or_404(models.Company, pk=cid)
         if (not request.user.has_perm("view_company", company)):
             raise PermissionDenied
-        sales = models.Sale.objects.filter(
-            company=company, cashflowdate__range=[after, before])
-        purchases = models.Purchase.objects.filter(
-            company=company, cashflowdate__range=[after, before])
-        vatIn = sum(sale.vat * sale.net for sale in sales)
-        vatOut = sum(purchase.vat * purchase.net for purchase in purchases)
+        vatIn, vatOut = closing.vat_totals(
+            company, after, before, include_archived(request))
         outData = [{"company": cid, "vatIn": vatIn, "vatOut": vatOut}]
         results = serializers.VatReportSerializer(
             instance=outData, many=True).data
         return Response(results)
 
 
-class PurchaseViewSet(viewsets.ModelViewSet):
+class CashflowViewset(viewsets.ViewSet):
+    """
+    A viewset for the cashflow timeline.
+    """
+    permission_classes = [IsAuthenticated]
+    expensive_actions = ["list"]
+    serializer_class = serializers.CashflowSerializer
+
+    def list(self, request):
+        """
+        This returns the cashflow of a company within a specified time range,
+        bucketed per day or week (interval parameter) including the running balance.
+        It also checks for the necessary permissions.
+        """
+        try:
+            before = parse_date(request.query_params.get("before") or "")
+            after = parse_date(request.query_params.get("after") or "")
+        except ValueError:
+            raise ValidationError(detail="Invalid date")
+        cid = request.query_params.get("cid")
+        interval = request.query_params.get("interval", "day")
+        if (cid is None or before is None or after is None):
+            raise APIException(detail="Url parameters missing")
+        if interval not in cashflow.INTERVALS:
+            raise ValidationError(detail="Unknown interval")
+        company = get_object_or_404(models.Company, pk=cid)
+        if (not request.user.has_perm("view_company", company)):
+            raise PermissionDenied
+        outData = cashflow.cashflow_timeline(
+            company, after, before, interval, include_archived(request))
+        results = serializers.CashflowSerializer(
+            instance=outData, many=True).data
+        return Response(results)
+
+
+class BankImportViewset(viewsets.ViewSet):
+    """
+    A viewset for the import of bank statements.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser]
+    expensive_actions = ["create"]
+
+    def create(self, request):
+        """
+        Matches the transactions of the uploaded CSV file (file) with the open sales and purchases of
+        the company and sets their cashflow dates. Returns the match report.
+        The columns (dateColumn, amountColumn, referenceColumn), delimiter, decimal, dateFormat,
+        encoding, window (days) and minConfidence can be set, apply=false only returns the report.
+        Only the bookings the user can view are matched and only those the user can change are updated.
+        """
+        serializer = serializers.BankImportSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = dict(serializer.validated_data)
+        file = options.pop("file")
+        apply = options.pop("apply")
+        company = get_object_or_404(models.Company, pk=options.pop("company"))
+        if (not request.user.has_perm("view_company", company)):
+            raise PermissionDenied
+        try:
+            report = bankimport.import_statement(company, file, options, apply, request.user)
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise ValidationError({"file": "Invalid file: %s" % exc})
+        return Response(report)
+
+
+class PurchaseViewSet(DuplicateCheckMixin, ArchiveMixin, PeriodLockMixin, ChangeEventMixin, DeltaSyncMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     A viewset for the purchases.
     """
-    queryset = models.Purchase.objects.all()
+    queryset = models.Purchase.objects.prefetch_related('invoice')
     serializer_class = serializers.PurchaseSerializer
+    fast_fields = {'gross': ['net', 'vat']}
+    archive_serializer_class = serializers.ArchivedPurchaseSerializer
     filterset_class = PurchaseFilter
     filter_backends = [filters.DjangoFilterBackend,
                        guardianFilters.ObjectPermissionsFilter]
 
 
+class ClosedPeriodViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    A viewset for the closed periods.
+    Closed periods cannot be changed or deleted.
+    """
+    permission_classes = [IsAuthenticated]
+    expensive_actions = ["create"]
+    serializer_class = serializers.ClosedPeriodSerializer
+    filterset_fields = ['company']
+
+    def get_queryset(self):
+        """
+        This ensures that the user can only see closed periods of his companies.
+        """
+        companies = get_objects_for_user(
+            self.request.user, "view_company", klass=models.Company)
+        return models.ClosedPeriod.objects.filter(company__in=companies).prefetch_related('totals')
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     A viewset for the sales.
@@ -172,6 +568,24 @@ class UserViewSet(viewsets.ModelViewSet):
         else:
             return serializers.RegisterUserSerializer
 
+    @action(detail=False, methods=["post"])
+    def invite(self, request):
+        """
+        Creates many users at once (a list of users is expected).
+        The users are created like with the UserSerializer, but in bulk.
+        """
+        allowedGroups = [
+            set(get_objects_for_user(request.user, "change_group", klass=Group).values_list("pk", flat=True)),
+            set(request.user.groups.values_list("pk", flat=True))
+        ]
+        serializer = serializers.UserInviteSerializer(
+            data=request.data, many=True, context={"request": request, "allowedGroups": allowedGroups})
+        serializer.is_valid(raise_exception=True)
+        users = serializer.save()
+        users = User.objects.filter(
+            pk__in=[user.pk for user in users]).prefetch_related("groups")
+        return Response(serializers.UserInviteSerializer(users, many=True).data, status=201)
+
 
 class GroupViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -187,7 +601,7 @@ class GroupViewSet(viewsets.ReadOnlyModelViewSet):
         return get_objects_for_user(self.request.user, "change_group", klass=Group)
 
 
-class MediaViewSet(viewsets.ModelViewSet):
+class MediaViewSet(ChangeEventMixin, DeltaSyncMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     A viewset for medias.
     The metadata for the media can be retrieved by filtering the list view.
@@ -209,9 +623,10 @@ class MediaViewSet(viewsets.ModelViewSet):
         serializer = serializers.MediaSerializer(
             data=file_input, context={'request': request})
         if serializer.is_valid():
-            serializer.save()
-            default_storage.save(
-                'media/' + str(serializer.data['id']), ContentFile(file.read()))
+            self.perform_create(serializer)
+            # the file is only written once the media is committed (e.g. not if a batch is rolled back)
+            name, content = 'media/' + str(serializer.data['id']), ContentFile(file.read())
+            transaction.on_commit(lambda: default_storage.save(name, content))
             return Response(serializer.data)
         return Response(serializer.errors, status=400)
 
@@ -229,3 +644,44 @@ class MediaViewSet(viewsets.ModelViewSet):
         response['Content-Disposition'] = 'inline; filename=' + \
                                           original_file_name
         return response
+
+    def perform_destroy(self, instance):
+        """
+        The sales and purchases using this media lose their invoice,
+        so they are marked as changed for the delta sync.
+        """
+        with transaction.atomic():
+            now = timezone.now()
+            models.Sale.objects.filter(invoice=instance).update(updated_at=now)
+            models.Purchase.objects.filter(
+                invoice=instance).update(updated_at=now)
+            super().perform_destroy(instance)
+
+
+class BatchView(views.APIView):
+    """
+    Executes a list of operations (method, path, body, files) in one request and one transaction.
+    The request is authenticated once, the operations are executed as this user.
+    If an operation fails, all operations are rolled back and the remaining ones are skipped.
+    The operations are posted as list or in the operations field. Files are uploaded as multipart parts,
+    the operations are passed as JSON in the operations field then.
+    """
+    permission_classes = [IsAuthenticated]
+    expensive_actions = ["post"]
+
+    def post(self, request):
+        data = request.data
+        if isinstance(data, list):
+            data = {"operations": data}
+        serializer = serializers.BatchSerializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        results = []
+        with transaction.atomic():
+            for operation in serializer.validated_data["operations"]:
+                status, body = batch.dispatch(
+                    request, operation, results, request.FILES)
+                results.append({"status": status, "body": body})
+                if status >= 400:
+                    transaction.set_rollback(True)
+                    return Response(results, status=400)
+        return Response(results)
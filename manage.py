@@ -6,6 +6,9 @@ import sys
 
 def main():
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swengs.settings')
+    if os.environ.get('ACCOUNTX_IMPORT_PROFILE'):
+        from accountx import importtime
+        importtime.install()
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
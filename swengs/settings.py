@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 import datetime
+from importlib.util import find_spec
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -45,12 +46,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'accountx.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'accountx.middleware.ReplicaRoutingMiddleware',
+    'accountx.middleware.RateLimitHeadersMiddleware',
 ]
 
 ROOT_URLCONF = 'swengs.urls'
@@ -81,9 +85,49 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': int(os.environ.get('ACCOUNTX_CONN_MAX_AGE', 60)),
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# Optional read replica, read only requests are routed to it (see accountx/db.py).
+# In tests the replica mirrors the default database.
+if os.environ.get('ACCOUNTX_REPLICA_DB'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['ACCOUNTX_REPLICA_DB'],
+        'CONN_MAX_AGE': int(os.environ.get('ACCOUNTX_CONN_MAX_AGE', 60)),
+        'OPTIONS': {'timeout': 20},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['accountx.db.ReadReplicaRouter']
+
+# The member directory, the replica stickiness and optionally the throttle buckets are cached.
+# With several worker processes the cache has to be shared (e.g. memcached), the local memory
+# cache only works for a single process.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('ACCOUNTX_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('ACCOUNTX_CACHE_LOCATION', ''),
+    }
+}
+
+# Reads after a write of the same user use the default database for this many seconds (needs a shared cache).
+ACCOUNTX_REPLICA_STICKY_SECONDS = 5
+
+# Applied to every new SQLite connection.
+ACCOUNTX_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+# Database for the archived sales and purchases (see accountx/archive.py).
+# To use a separate database, add it to DATABASES and run migrate --database on it.
+ACCOUNTX_ARCHIVE_DATABASE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -134,7 +178,54 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'accountx.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # Token buckets per user and per company, see accountx/throttling.py
+    'DEFAULT_THROTTLE_CLASSES': [
+        'accountx.throttling.UserThrottle',
+        'accountx.throttling.CompanyThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'user': '600/min',
+        'company': '1200/min',
+        'user_expensive': '30/min',
+        'company_expensive': '60/min',
+    },
 }
+# MessagePack (Accept/Content-Type: application/msgpack) is only offered if msgpack is installed.
+if find_spec('msgpack') is not None:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].insert(
+        1, 'accountx.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append(
+        'accountx.renderers.MessagePackParser')
+
+# The delta sync tokens lag this many seconds behind, so changes of slow transactions are not skipped.
+ACCOUNTX_SYNC_MARGIN = 60
+
+# Seconds an event stream stays open (it occupies a worker thread), the client reconnects after it.
+ACCOUNTX_EVENT_STREAM_SECONDS = 60
+
+# Days the change log (event streams) is kept by "manage.py prune_changes".
+ACCOUNTX_CHANGELOG_DAYS = 7
+
+# Near duplicates of sales and purchases: same net amount and invoice date within this many days.
+ACCOUNTX_DUPLICATE_DAYS = 3
+
+# Responses smaller than this (in bytes) are not compressed.
+ACCOUNTX_COMPRESSION_MIN_SIZE = 1024
+
+# Seconds the pages of the company member directory are cached (changes of the memberships invalidate them).
+ACCOUNTX_MEMBERS_CACHE_TIMEOUT = 300
+
+# Cache alias for the throttle buckets (shared between workers), None keeps them in process.
+ACCOUNTX_THROTTLE_CACHE = os.environ.get('ACCOUNTX_THROTTLE_CACHE') or None
 AUTH_PASSWORD_VALIDATORS = []  # Just for development (Complex passwords suck)
 AUTHENTICATION_BACKENDS = (
     'django.contrib.auth.backends.ModelBackend',  # default
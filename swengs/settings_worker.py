@@ -0,0 +1,39 @@
+"""
+Lightweight settings for background workers, management commands and API-only WSGI workers:
+    DJANGO_SETTINGS_MODULE=swengs.settings_worker
+The admin (and with it the guardian admin) and the browsable API are not loaded, the session,
+auth, message and csrf middleware are skipped. The API authenticates with JWT (or basic auth)
+itself, so it works the same. Run migrate with the full settings, the admin tables are not
+managed here.
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+    'django.contrib.admin',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+)]
+
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+)]
+
+TEMPLATES[0]['OPTIONS']['context_processors'] = [
+    'django.template.context_processors.debug',
+    'django.template.context_processors.request',
+]
+
+ROOT_URLCONF = 'swengs.urls_worker'
+
+REST_FRAMEWORK = dict(
+    REST_FRAMEWORK,
+    DEFAULT_AUTHENTICATION_CLASSES=(
+        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+    DEFAULT_RENDERER_CLASSES=[renderer for renderer in REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES']
+                              if renderer != 'rest_framework.renderers.BrowsableAPIRenderer'],
+)
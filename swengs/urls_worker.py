@@ -0,0 +1,12 @@
+"""
+The url configuration of the lightweight settings (settings_worker.py): the API without the admin
+and without the session login of the browsable API.
+"""
+from django.conf.urls import url
+from django.urls import include, path
+from rest_framework_jwt.views import obtain_jwt_token
+
+urlpatterns = [
+    path('', include('accountx.urls')),
+    url(r'^api-token-auth/', obtain_jwt_token),
+]
@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+if os.environ.get('ACCOUNTX_IMPORT_PROFILE'):
+    from accountx import importtime
+    importtime.install()
+
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swengs.settings')
 
 application = get_wsgi_application()
+
+if os.environ.get('ACCOUNTX_IMPORT_PROFILE'):
+    # the views are loaded with the url configuration on the first request, load them now to include them
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    importtime.report('wsgi')